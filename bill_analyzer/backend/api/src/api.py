@@ -1,6 +1,7 @@
 # Created by Metrum AI for Dell
 """FastAPI application for managing bill analysis workflow."""
 import time
+from typing import List, Optional
 
 import requests
 from auth.auth_service import AuthService
@@ -15,6 +16,7 @@ from fastapi import (
     status,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from prefect.client.orchestration import get_client
 from prefect_client_func import (
@@ -22,7 +24,9 @@ from prefect_client_func import (
     fetch_replica_ids,
     fetch_task_status,
     start_analysis_runs,
+    start_batch_runs,
 )
+from stream_client_func import relay_token_streams, stream_keys
 
 logger = configure_logger("Legislative Analysis")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
@@ -90,12 +94,38 @@ async def change_password(
 @auth_service.requires_auth
 @handle_exceptions
 async def start_runs(
-    request: Request, replicas: int, bill: UploadFile = File(...)
+    request: Request,
+    replicas: int,
+    adaptive: bool = False,
+    bill: UploadFile = File(...),
 ):
     """Start analysis runs for a bill."""
     try:
         async with get_client() as client:
-            return await start_analysis_runs(client, bill, replicas)
+            return await start_analysis_runs(
+                client, bill, replicas, adaptive
+            )
+    except Exception as exc:
+        raise HTTPException(
+            status_code=500, detail=f"Error starting flow: {str(exc)}"
+        ) from exc
+
+
+@app.post("/start_batch_runs", tags=["Bill Analyzer"])
+@auth_service.requires_auth
+@handle_exceptions
+async def start_batch(
+    request: Request,
+    max_concurrency: Optional[int] = None,
+    adaptive: bool = False,
+    bills: List[UploadFile] = File(...),
+):
+    """Start a batch analysis of several bills."""
+    try:
+        async with get_client() as client:
+            return await start_batch_runs(
+                client, bills, max_concurrency, adaptive
+            )
     except Exception as exc:
         raise HTTPException(
             status_code=500, detail=f"Error starting flow: {str(exc)}"
@@ -140,3 +170,18 @@ async def get_artifact(request: Request, key: str):
         raise HTTPException(
             status_code=500, detail=f"Request error occurred: {str(req_err)}"
         ) from req_err
+
+
+@app.get("/stream_output", tags=["Bill Analyzer"])
+@auth_service.requires_auth
+@handle_exceptions
+async def stream_output(
+    request: Request, flow_run_id: str, agent: Optional[str] = None
+):
+    """Stream the tokens of a replica's agents as server-sent events."""
+    keys = stream_keys(flow_run_id, agent)
+    return StreamingResponse(
+        relay_token_streams(keys),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -15,17 +15,18 @@ PREFECT_API_URL = os.getenv(
 import requests
 
 
-async def start_analysis_runs(client, bill, replicas):
-    """Start analysis runs for a given bill with specified replicas."""
+async def save_bill(bill):
+    """Save an uploaded bill to the shared temp directory."""
     contents = await bill.read()
     with NamedTemporaryFile(delete=False) as temp_file:
         temp_file.write(contents)
-        temp_file_path = temp_file.name
+        return temp_file.name
+
 
-    deployment_id = (
-        await client.read_deployment_by_name("start/agent_run")
-    ).id
-    params = {"parameters": {"bill": temp_file_path, "replicas": replicas}}
+async def create_flow_run(client, deployment_name, parameters):
+    """Create a flow run of a deployment and wait for it to start."""
+    deployment_id = (await client.read_deployment_by_name(deployment_name)).id
+    params = {"parameters": parameters}
     response = requests.post(
         f"{PREFECT_API_URL}/deployments/{deployment_id}/create_flow_run",
         json=params,
@@ -48,6 +49,29 @@ async def start_analysis_runs(client, bill, replicas):
     return {"flow_run_id": flow_run_id, "state": state}
 
 
+async def start_analysis_runs(client, bill, replicas, adaptive=False):
+    """Start analysis runs for a given bill with specified replicas."""
+    temp_file_path = await save_bill(bill)
+    return await create_flow_run(
+        client,
+        "start/agent_run",
+        {"bill": temp_file_path, "replicas": replicas, "adaptive": adaptive},
+    )
+
+
+async def start_batch_runs(
+    client, bills, max_concurrency=None, adaptive=False
+):
+    """Start a batch analysis of different bills with bounded concurrency."""
+    temp_file_paths = [await save_bill(bill) for bill in bills]
+    parameters = {"bills": temp_file_paths, "adaptive": adaptive}
+    if max_concurrency:
+        parameters["max_concurrency"] = max_concurrency
+    return await create_flow_run(
+        client, "start_batch/agent_batch_run", parameters
+    )
+
+
 def fetch_replica_ids(flow_run_id):
     """Fetch replica IDs for a given flow run."""
     url = f"{PREFECT_API_URL}/flow_runs/{flow_run_id}/graph-v2"
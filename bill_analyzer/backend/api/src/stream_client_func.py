@@ -0,0 +1,80 @@
+# Created by Metrum AI for Dell
+"""
+This module relays the tokens that the bill analysis agents publish to
+valkey streams as server-sent events.
+"""
+
+import json
+import logging
+
+import redis.asyncio as redis
+from auth.utils import read_config_vars
+
+AGENT_KEYS = ["legal", "social", "economic", "report"]
+
+logger = logging.getLogger(__name__)
+configs = read_config_vars(
+    {
+        "REDIS_HOST": "redis",
+        "REDIS_PORT": 6379,
+        "REDIS_DB": 0,
+        "STREAM_IDLE_TIMEOUT": 300,
+    },
+    [],
+    logger,
+)
+
+
+def stream_keys(flow_run_id, agent=None):
+    """Return the output keys streamed for a replica's flow run.
+
+    Streams are keyed by the flow run ID of the replica, as returned by
+    /get_replica_ids, so concurrent runs never share a stream.
+    """
+    agents = [agent] if agent else AGENT_KEYS
+    for name in agents:
+        if name not in AGENT_KEYS:
+            raise ValueError(f"Unknown agent: {name}")
+    return [f"{flow_run_id}:{name}" for name in agents]
+
+
+def format_event(key, fields):
+    """Format a published stream entry as a server-sent event."""
+    payload = json.loads(fields[b"data"])
+    payload["key"] = key
+    return f"event: {payload['event']}\ndata: {json.dumps(payload)}\n\n"
+
+
+async def relay_token_streams(keys):
+    """Yield the events of the given output keys as server-sent events.
+
+    Events are relayed from the start of each stream, so a client that
+    connects late still receives every token. The relay ends once every
+    key has published its final output, or when no event arrived for
+    STREAM_IDLE_TIMEOUT seconds.
+    """
+    client = redis.Redis(
+        host=configs["REDIS_HOST"],
+        port=int(configs["REDIS_PORT"]),
+        db=int(configs["REDIS_DB"]),
+    )
+    offsets = {f"stream:{key}": "0" for key in keys}
+    idle_timeout_ms = int(configs["STREAM_IDLE_TIMEOUT"]) * 1000
+    try:
+        while offsets:
+            entries = await client.xread(offsets, block=idle_timeout_ms)
+            if not entries:
+                yield "event: timeout\ndata: {}\n\n"
+                return
+            for stream, messages in entries:
+                stream = stream.decode()
+                key = stream.removeprefix("stream:")
+                for message_id, fields in messages:
+                    offsets[stream] = message_id
+                    event = format_event(key, fields)
+                    yield event
+                    if event.startswith("event: done"):
+                        offsets.pop(stream)
+                        break
+    finally:
+        await client.aclose()
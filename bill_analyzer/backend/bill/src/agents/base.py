@@ -0,0 +1,258 @@
+# Created by Metrum AI for Dell
+"""Base agent that runs its analysis steps as a dependency graph."""
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+from context import build_step_context
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+from langchain_openai import ChatOpenAI
+from langgraph.graph import END, START, StateGraph
+from prefect.logging import get_run_logger
+from retrieval import (
+    aget_prompt_context,
+    get_prompt_context,
+    warm_prompt_context,
+)
+from prompts import format_context
+from streaming import close_streams, stream_callbacks
+from utils import create_analysis_chain, get_llm_model
+
+from .models import AnalysisStep, OverallState
+
+
+class AnalysisAgent:
+    """Base class for the specialist bill analysis agents.
+
+    Subclasses declare their analysis steps and, for each step, the steps
+    whose output it builds on. Steps without pending dependencies run as
+    parallel graph branches, and every branch fans in to the final
+    recommendation. Every node has a sync and an async implementation, so
+    the same graph serves both run and arun.
+    """
+
+    steps: Dict[str, AnalysisStep] = {}
+    recommendation_prompt: str = ""
+
+    def __init__(self, llm: Optional[ChatOpenAI] = None):
+        """Initialize the agent.
+
+        Args:
+            llm: Optional language model to use
+        """
+        self.model = llm if llm else get_llm_model()
+        self.agent = self._build_graph()
+        self.logger = get_run_logger()
+
+    @classmethod
+    def warm_up(cls) -> None:
+        """Precompute the retrieval context of every step prompt."""
+        warm_prompt_context(step.prompt for step in cls.steps.values())
+
+    def _build_graph(self) -> StateGraph:
+        """Build the analysis workflow graph from the step dependencies."""
+        graph = StateGraph(OverallState)
+        built_on = set()
+        for name, step in self.steps.items():
+            graph.add_node(
+                name,
+                RunnableLambda(
+                    partial(self._analyze, name),
+                    afunc=partial(self._aanalyze, name),
+                ),
+            )
+            if step.depends_on:
+                graph.add_edge(list(step.depends_on), name)
+                built_on.update(step.depends_on)
+            else:
+                graph.add_edge(START, name)
+        graph.add_node(
+            "recommendation",
+            RunnableLambda(
+                self._make_recommendation,
+                afunc=self._amake_recommendation,
+            ),
+        )
+        graph.add_edge(
+            [name for name in self.steps if name not in built_on],
+            "recommendation",
+        )
+        graph.add_edge("recommendation", END)
+        return graph.compile()
+
+    def _select_context(
+        self, retrieved_data: List[Document], bill_context: List[str]
+    ) -> List[str]:
+        """Log the sources of retrieved context and select its passages.
+
+        Args:
+            retrieved_data: Retrieved documents
+            bill_context: Context shared by every step for the bill
+
+        Returns:
+            List of relevant context strings within the step budget
+        """
+        logs = [res.metadata["metadata"] for res in retrieved_data]
+        self.logger.info("Retrieved data from %s", logs)
+        return build_step_context(retrieved_data, bill_context)
+
+    def _get_context(self, prompt: str, bill_context: List[str]) -> List[str]:
+        """Get relevant context for analysis.
+
+        Args:
+            prompt: Prompt to retrieve context for
+            bill_context: Context shared by every step for the bill
+
+        Returns:
+            List of relevant context strings
+        """
+        return self._select_context(get_prompt_context(prompt), bill_context)
+
+    async def _aget_context(
+        self, prompt: str, bill_context: List[str]
+    ) -> List[str]:
+        """Get relevant context for analysis asynchronously.
+
+        Args:
+            prompt: Prompt to retrieve context for
+            bill_context: Context shared by every step for the bill
+
+        Returns:
+            List of relevant context strings
+        """
+        return self._select_context(
+            await aget_prompt_context(prompt), bill_context
+        )
+
+    @staticmethod
+    def _step_sections(step: AnalysisStep) -> List[Tuple[str, str]]:
+        """Return the step-specific prompt sections of an analysis step."""
+        sections = [("STEP CONTEXT", "step_context")]
+        if step.depends_on:
+            sections.append((step.analysis_title, "analysis"))
+        return sections
+
+    def _step_inputs(
+        self, step: AnalysisStep, state: OverallState, context: List[str]
+    ) -> dict:
+        """Build the prompt inputs of an analysis step.
+
+        The bill and the bill's context form the prefix shared by every
+        step, so the step's own retrieved context goes in its own section.
+        """
+        return {
+            "bill": state["bill"],
+            "context": format_context(state["context"]),
+            "step_context": format_context(context),
+            "analysis": format_context(
+                state["reviews"][dep] for dep in step.depends_on
+            ),
+        }
+
+    def _recommendation_chain(self):
+        """Build the chain of the final recommendation."""
+        return create_analysis_chain(
+            self.model, self.recommendation_prompt, [("ANALYSIS", "p_a")]
+        )
+
+    def _recommendation_inputs(self, state: OverallState) -> dict:
+        """Build the prompt inputs of the final recommendation."""
+        return {
+            "bill": state["bill"],
+            "context": format_context(state["context"]),
+            "p_a": format_context(
+                state["reviews"][name] for name in self.steps
+            ),
+        }
+
+    def _analyze(self, name: str, state: OverallState) -> dict:
+        """Run a single analysis step.
+
+        Args:
+            name: Name of the step to run
+            state: Current workflow state
+
+        Returns:
+            Dict containing the step's review
+        """
+        step = self.steps[name]
+        chain = create_analysis_chain(
+            self.model, step.prompt, self._step_sections(step)
+        )
+        context = self._get_context(step.prompt, state["context"])
+        response = chain.invoke(self._step_inputs(step, state, context))
+        return {"reviews": {name: response.content}}
+
+    async def _aanalyze(self, name: str, state: OverallState) -> dict:
+        """Run a single analysis step asynchronously.
+
+        Args:
+            name: Name of the step to run
+            state: Current workflow state
+
+        Returns:
+            Dict containing the step's review
+        """
+        step = self.steps[name]
+        chain = create_analysis_chain(
+            self.model, step.prompt, self._step_sections(step)
+        )
+        context = await self._aget_context(step.prompt, state["context"])
+        response = await chain.ainvoke(
+            self._step_inputs(step, state, context)
+        )
+        return {"reviews": {name: response.content}}
+
+    def _make_recommendation(self, state: OverallState) -> dict:
+        """Make final recommendation based on analysis."""
+        chain = self._recommendation_chain()
+        response = chain.invoke(self._recommendation_inputs(state))
+        return {"review": response.content}
+
+    async def _amake_recommendation(self, state: OverallState) -> dict:
+        """Make final recommendation based on analysis asynchronously."""
+        chain = self._recommendation_chain()
+        response = await chain.ainvoke(self._recommendation_inputs(state))
+        return {"review": response.content}
+
+    def run(
+        self, bill: str, context: List[str], stream_key: Optional[str] = None
+    ) -> str:
+        """Run the full analysis workflow.
+
+        Args:
+            bill: Bill text to analyze
+            context: List of context strings
+            stream_key: Optional output key to stream tokens to
+
+        Returns:
+            Final analysis report
+        """
+        callbacks = stream_callbacks(stream_key)
+        analysis_result = self.agent.invoke(
+            {"bill": bill, "context": context, "reviews": {}},
+            config={"callbacks": callbacks},
+        )
+        close_streams(callbacks, analysis_result["review"])
+        return analysis_result["review"]
+
+    async def arun(
+        self, bill: str, context: List[str], stream_key: Optional[str] = None
+    ) -> str:
+        """Run the full analysis workflow asynchronously.
+
+        Args:
+            bill: Bill text to analyze
+            context: List of context strings
+            stream_key: Optional output key to stream tokens to
+
+        Returns:
+            Final analysis report
+        """
+        callbacks = stream_callbacks(stream_key)
+        analysis_result = await self.agent.ainvoke(
+            {"bill": bill, "context": context, "reviews": {}},
+            config={"callbacks": callbacks},
+        )
+        close_streams(callbacks, analysis_result["review"])
+        return analysis_result["review"]
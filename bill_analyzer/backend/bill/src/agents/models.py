@@ -1,5 +1,4 @@
-import operator
-from typing import Annotated, List, TypedDict
+from typing import Annotated, Dict, List, Tuple, TypedDict
 
 from pydantic import BaseModel, Field
 
@@ -25,10 +24,30 @@ class LastAnalysis(BaseModel):
     )
 
 
+class AnalysisStep(BaseModel):
+    """A single analysis step of an agent and the steps it builds on."""
+
+    prompt: str = Field(..., description="Prompt template for the step")
+    depends_on: Tuple[str, ...] = Field(
+        default=(), description="Steps whose analysis this step builds on"
+    )
+    analysis_title: str = Field(
+        default="ANALYSIS",
+        description="Title of the section holding the analysis built on",
+    )
+
+
+def merge_reviews(
+    left: Dict[str, str], right: Dict[str, str]
+) -> Dict[str, str]:
+    """Merge the reviews written by parallel analysis steps."""
+    return {**left, **right}
+
+
 class OverallState(TypedDict):
     """State type for the analysis workflow."""
 
     bill: str
-    reviews: Annotated[List, operator.add]
+    reviews: Annotated[Dict[str, str], merge_reviews]
     review: str
-    context: str
+    context: List[str]
@@ -0,0 +1,167 @@
+# Created by Metrum AI for Dell
+"""Benchmark of prefill time with the shared-prefix prompt layout.
+
+Sends the prompts of every agent step, recommendation and the report for one
+bill to vLLM twice: once in the shared-prefix layout used by the agents, and
+once in the previous layout that put the instruction before the bill. Every
+call generates a single token, so its latency is dominated by prefill.
+
+Usage:
+    python3 benchmark_prefix.py /tmp/bill.pdf --trials 3
+"""
+import argparse
+import logging
+import statistics
+import time
+import uuid
+from typing import Dict, List, Tuple
+
+from agents.ebi_agent import EBIAgent
+from agents.lac_agent import LACAgent
+from agents.sei_agent import SEIAgent
+from context import build_step_context
+from generator import SYNTHESIS_PROMPT
+from langchain_core.messages import BaseMessage
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_openai import ChatOpenAI
+from prompts import SEPARATOR, SYSTEM_MESSAGE, build_prompt, format_context
+from rag import get_bill, get_list
+from retrieval import get_prompt_context
+from utils import ANSWER_LIMIT, read_config_vars
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_ANALYSIS = "Analysis of the bill. " * 40
+
+
+def legacy_prompt(
+    instruction: str, sections: List[Tuple[str, str]]
+) -> ChatPromptTemplate:
+    """Build a prompt in the previous layout, instruction first."""
+    body = f"{instruction}\n{SEPARATOR}\n"
+    for title, variable in [("BILL", "bill"), ("CONTEXT", "context")]:
+        body += f"{title}\n{{{variable}}}\n{SEPARATOR}\n"
+    for title, variable in sections:
+        body += f"{title}\n{{{variable}}}\n{SEPARATOR}\n"
+    return ChatPromptTemplate.from_messages(
+        [("system", SYSTEM_MESSAGE), ("human", body)]
+    )
+
+
+def bill_calls(
+    bill: str, context: List[str]
+) -> List[Tuple[str, List[Tuple[str, str]], dict]]:
+    """Return the (instruction, sections, inputs) of every call for a bill."""
+    shared = {"bill": bill, "context": format_context(context)}
+    calls = []
+    for agent in (LACAgent, SEIAgent, EBIAgent):
+        for step in agent.steps.values():
+            sections = agent._step_sections(step)
+            inputs = {
+                **shared,
+                "step_context": format_context(
+                    build_step_context(
+                        get_prompt_context(step.prompt), context
+                    )
+                ),
+                "analysis": PLACEHOLDER_ANALYSIS,
+            }
+            instruction = f"{ANSWER_LIMIT}\n{step.prompt}"
+            calls.append((instruction, sections, inputs))
+        calls.append(
+            (
+                f"{ANSWER_LIMIT}\n{agent.recommendation_prompt}",
+                [("ANALYSIS", "p_a")],
+                {**shared, "p_a": PLACEHOLDER_ANALYSIS * 3},
+            )
+        )
+    calls.append(
+        (
+            SYNTHESIS_PROMPT,
+            [("ANALYSIS FROM AGENTS", "analysis")],
+            {**shared, "analysis": PLACEHOLDER_ANALYSIS * 3},
+        )
+    )
+    return calls
+
+
+def time_calls(model: ChatOpenAI, messages: List[List[BaseMessage]]) -> float:
+    """Send the calls in order and return their total latency in seconds."""
+    total = 0.0
+    for message in messages:
+        start = time.perf_counter()
+        model.invoke(message)
+        total += time.perf_counter() - start
+    return total
+
+
+def run_benchmark(bill_path: str, trials: int) -> Dict[str, List[float]]:
+    """Time every call of a bill in both layouts.
+
+    Args:
+        bill_path: Path to the bill PDF
+        trials: Number of trials per layout
+
+    Returns:
+        Total prefill seconds of each trial, keyed by layout
+    """
+    configs = read_config_vars(
+        {
+            "MODEL_NAME": "meta-llama/Llama-3.2-3B-Instruct",
+            "API_KEY": None,
+            "VLLM_URL": "http://nginx-proxy:8100/vllm/v1",
+        }
+    )
+    model = ChatOpenAI(
+        model=configs["MODEL_NAME"],
+        api_key=configs["API_KEY"],
+        base_url=configs["VLLM_URL"],
+        temperature=0,
+        max_tokens=1,
+        cache=False,
+    )
+    bill, context = get_list(get_bill(bill_path))
+    results = {"shared-prefix": [], "instruction-first": []}
+    for trial in range(trials):
+        for layout, build in (
+            ("shared-prefix", build_prompt),
+            ("instruction-first", legacy_prompt),
+        ):
+            # A fresh marker per trial and layout keeps earlier runs of the
+            # same bill out of vLLM's prefix cache.
+            marked_bill = f"[{uuid.uuid4()}]\n{bill}"
+            messages = [
+                build(instruction, sections).format_messages(
+                    **{**inputs, "bill": marked_bill}
+                )
+                for instruction, sections, inputs in bill_calls(bill, context)
+            ]
+            seconds = time_calls(model, messages)
+            results[layout].append(seconds)
+            logger.info(
+                f"Trial {trial + 1} {layout}: {len(messages)} calls "
+                f"in {seconds:.2f}s"
+            )
+    return results
+
+
+def main():
+    """Run the benchmark and log the prefill time of each layout."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("bill", help="Path to the bill PDF")
+    parser.add_argument("--trials", type=int, default=3)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.bill, args.trials)
+    baseline = statistics.mean(results["instruction-first"])
+    for layout, seconds in results.items():
+        mean = statistics.mean(seconds)
+        logger.info(
+            f"{layout}: mean {mean:.2f}s per bill, "
+            f"{baseline / mean:.2f}x vs instruction-first"
+        )
+
+
+if __name__ == "__main__":
+    main()
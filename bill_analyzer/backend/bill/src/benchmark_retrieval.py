@@ -0,0 +1,91 @@
+# Created by Metrum AI for Dell
+"""Benchmark of the section ID retrieval paths.
+
+Extracts the section IDs cited by a bill and retrieves their context with
+one vector search per ID, with the batched vector search, and with the
+section index lookup used by get_list. Logs the latency of each and
+whether the two vector searches returned the same documents.
+
+Usage:
+    python3 benchmark_retrieval.py /tmp/bill.pdf --trials 5
+"""
+import argparse
+import logging
+import statistics
+import time
+from typing import Callable, Dict, List, Tuple
+
+from citations import extract_section_ids
+from langchain_core.documents import Document
+from rag import get_bill
+from retrieval import (
+    ingested_ids,
+    lookup_section_ids,
+    search_section_ids,
+    search_section_ids_serial,
+)
+from utils import warm_up_resources
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SearchResults = Dict[str, List[Tuple[Document, float]]]
+
+
+def time_search(
+    search: Callable[[List[str]], SearchResults], ids: List[str], trials: int
+) -> Tuple[List[float], SearchResults]:
+    """Run a search several times and return its latencies and results."""
+    seconds = []
+    for _ in range(trials):
+        start = time.perf_counter()
+        results = search(ids)
+        seconds.append(time.perf_counter() - start)
+    return seconds, results
+
+
+def same_documents(left: SearchResults, right: SearchResults) -> bool:
+    """Return whether two searches returned the same documents per ID."""
+    return all(
+        {doc.page_content for doc, _ in left[section_id]}
+        == {doc.page_content for doc, _ in right.get(section_id, [])}
+        for section_id in left
+    )
+
+
+def main():
+    """Run the benchmark and log the latency of each search."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("bill", help="Path to the bill PDF")
+    parser.add_argument("--trials", type=int, default=5)
+    args = parser.parse_args()
+
+    warm_up_resources()
+    ids = extract_section_ids(get_bill(args.bill), ingested_ids())
+    logger.info(f"Searching {len(ids)} section IDs")
+
+    serial, serial_results = time_search(
+        search_section_ids_serial, ids, args.trials
+    )
+    batched, batched_results = time_search(
+        search_section_ids, ids, args.trials
+    )
+    lookup, _ = time_search(lookup_section_ids, ids, args.trials)
+    for name, seconds in (
+        ("per-ID", serial),
+        ("batched", batched),
+        ("index lookup", lookup),
+    ):
+        logger.info(
+            f"{name}: median {statistics.median(seconds) * 1000:.3f}ms "
+            f"over {args.trials} trials"
+        )
+    speedup = statistics.median(serial) / statistics.median(batched)
+    logger.info(
+        f"Speedup: {speedup:.2f}x, "
+        f"same documents: {same_documents(serial_results, batched_results)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+# Created by Metrum AI for Dell
+"""In-process and on-disk caches used by the bill analysis service."""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import redis
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# Locks shared by the digests of BillTextStore. Two bills only wait on
+# each other when parsed at the same time with the same stripe.
+LOCK_STRIPES = 64
+# Age after which a temporary file of DiskResponseStore is abandoned.
+STALE_TEMP_SECONDS = 3600
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU mapping with hit and miss counters."""
+
+    def __init__(self, max_size: int):
+        """Initialize the cache.
+
+        Args:
+            max_size: Maximum number of entries kept before evicting
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value for a key and mark it as recently used."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Insert or refresh a key, evicting the least recently used."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hit, miss and size counters."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
+
+
+def file_digest(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """Return the SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BillTextStore:
+    """Parsed bill text keyed by the content hash of the source file.
+
+    Texts are held in an in-memory LRU and, when a directory is configured,
+    also written to disk so that every process sharing the directory and
+    every later upload of the same file skips parsing.
+    """
+
+    def __init__(self, max_size: int, directory: Optional[str] = None):
+        """Initialize the store.
+
+        Args:
+            max_size: Maximum number of texts kept in memory
+            directory: Optional directory for the on-disk store
+        """
+        self.directory = directory
+        self._memory = LRUCache(max_size)
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _key_lock(self, digest: str) -> threading.Lock:
+        """Return the lock that serializes parsing of one file content.
+
+        Digests share a fixed pool of locks, so the number of locks does
+        not grow with the number of bills seen.
+        """
+        return self._locks[int(digest[:8], 16) % len(self._locks)]
+
+    def _path(self, digest: str) -> str:
+        """Return the on-disk location of a parsed text."""
+        return os.path.join(self.directory, f"{digest}.txt")
+
+    def _read(self, digest: str) -> Optional[str]:
+        """Read a parsed text from disk, if present."""
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(digest), "r", encoding="utf-8") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, digest: str, text: str) -> None:
+        """Atomically write a parsed text to disk."""
+        if not self.directory:
+            return
+        temp_path = f"{self._path(digest)}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(temp_path, self._path(digest))
+
+    def get_or_parse(
+        self, file_path: str, parse: Callable[[str], str]
+    ) -> str:
+        """Return the parsed text of a file, parsing it only on a miss.
+
+        Args:
+            file_path: Path to the source file
+            parse: Callable that parses the file into text
+
+        Returns:
+            Parsed text content
+        """
+        digest = file_digest(file_path)
+        text = self._memory.get(digest)
+        if text is not None:
+            return text
+        with self._key_lock(digest):
+            text = self._memory.get(digest)
+            if text is None:
+                text = self._read(digest)
+            if text is None:
+                text = parse(file_path)
+                self._write(digest, text)
+            else:
+                logger.info(f"Bill cache hit for {file_path} ({digest[:12]})")
+            self._memory.put(digest, text)
+        return text
+
+
+class DiskResponseStore:
+    """Size-bounded LRU store of serialized responses on local disk.
+
+    The bound applies to the whole directory, which may be shared by
+    several processes. Reads refresh the modification time of an entry,
+    and every process periodically sweeps the directory, removing the
+    least recently used entries past the bound. Between sweeps the
+    directory can exceed the bound by the entries written since, about
+    1% of it per process.
+    """
+
+    def __init__(self, directory: str, max_size: int):
+        """Initialize the store and sweep the entries already on disk.
+
+        Args:
+            directory: Directory holding one file per entry
+            max_size: Maximum number of entries kept before evicting
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._sweep_every = max(1, max_size // 100)
+        os.makedirs(directory, exist_ok=True)
+        self._sweep()
+
+    def _path(self, key: str) -> str:
+        """Return the on-disk location of an entry."""
+        return os.path.join(self.directory, key)
+
+    def _sweep(self) -> None:
+        """Remove the least recently used entries past the bound.
+
+        Temporary files are not entries; ones left behind by a process
+        that died while writing are removed once they are stale.
+        """
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                if not entry.is_file():
+                    continue
+                mtime = entry.stat().st_mtime
+                if not entry.name.endswith(".tmp"):
+                    entries.append((mtime, entry.path))
+                elif now - mtime > STALE_TEMP_SECONDS:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                # Removed meanwhile by another process.
+                continue
+        entries.sort()
+        for _, path in entries[: max(0, len(entries) - self.max_size)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a stored value and mark it as recently used."""
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as file:
+                value = file.read()
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            return None
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        """Store a value, periodically evicting the least recently used."""
+        temp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write(value)
+        os.replace(temp_path, self._path(key))
+        with self._lock:
+            self._puts += 1
+            sweep = self._puts % self._sweep_every == 0
+        if sweep:
+            self._sweep()
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+class ValkeyResponseStore:
+    """Size-bounded LRU store of serialized responses in valkey."""
+
+    def __init__(self, client: redis.Redis, max_size: int, prefix: str):
+        """Initialize the store.
+
+        Args:
+            client: Valkey client
+            max_size: Maximum number of entries kept before evicting
+            prefix: Key prefix of the store's entries
+        """
+        self.client = client
+        self.max_size = max_size
+        self.prefix = prefix
+        self._recency_key = f"{prefix}recency"
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a stored value and mark it as recently used."""
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        self.client.zadd(self._recency_key, {key: time.time()})
+        return value.decode("utf-8")
+
+    def put(self, key: str, value: str) -> None:
+        """Store a value, evicting the least recently used entries."""
+        pipeline = self.client.pipeline()
+        pipeline.set(self.prefix + key, value)
+        pipeline.zadd(self._recency_key, {key: time.time()})
+        pipeline.zcard(self._recency_key)
+        size = pipeline.execute()[-1]
+        if size > self.max_size:
+            evicted = self.client.zpopmin(
+                self._recency_key, size - self.max_size
+            )
+            if evicted:
+                self.client.delete(
+                    *(
+                        self.prefix + old_key.decode("utf-8")
+                        for old_key, _ in evicted
+                    )
+                )
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        keys = self.client.zrange(self._recency_key, 0, -1)
+        if keys:
+            self.client.delete(
+                *(self.prefix + key.decode("utf-8") for key in keys)
+            )
+        self.client.delete(self._recency_key)
+
+
+class LLMResponseCache(BaseCache):
+    """LangChain cache of model responses for deterministic generation.
+
+    Entries are keyed by the model's LLM string, which carries the model
+    name and generation parameters, and the fully rendered messages. It is
+    only correct for temperature 0 calls.
+    """
+
+    def __init__(self, store: Any):
+        """Initialize the cache.
+
+        Args:
+            store: DiskResponseStore or ValkeyResponseStore holding entries
+        """
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        """Return the store key of a prompt and model configuration."""
+        return hashlib.sha256(
+            f"{llm_string}\0{prompt}".encode("utf-8")
+        ).hexdigest()
+
+    def lookup(
+        self, prompt: str, llm_string: str
+    ) -> Optional[RETURN_VAL_TYPE]:
+        """Look up the cached generations of a prompt."""
+        value = self.store.get(self._key(prompt, llm_string))
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return loads(value) if value is not None else None
+
+    def update(
+        self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE
+    ) -> None:
+        """Store the generations of a prompt."""
+        self.store.put(self._key(prompt, llm_string), dumps(return_val))
+
+    def clear(self, **kwargs: Any) -> None:
+        """Remove every cached response."""
+        self.store.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hit and miss counters."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,85 @@
+# Created by Metrum AI for Dell
+"""Section-aware splitting of bill text into token-bounded chunks."""
+import re
+from typing import Callable, List
+
+# Section headings as printed in bills, e.g. "SECTION 1." or "SEC. 12.".
+SECTION_PATTERN = re.compile(r"(?m)^(?=[ \t]*(?:SECTION|SEC\.)[ \t]+\d+)")
+
+
+def split_sections(text: str) -> List[str]:
+    """Split bill text at its section headings.
+
+    Args:
+        text: Raw bill text
+
+    Returns:
+        Non-empty pieces of the text, the first holding any preamble
+    """
+    return [piece for piece in SECTION_PATTERN.split(text) if piece.strip()]
+
+
+def _split_oversized(
+    text: str, max_tokens: int, count_tokens: Callable[[str], int]
+) -> List[str]:
+    """Split a piece larger than the budget at lines, then at characters."""
+    pieces = text.splitlines(keepends=True)
+    if len(pieces) == 1:
+        # One long line: split it evenly into pieces that fit.
+        parts = -(-count_tokens(text) // max_tokens)
+        size = -(-len(text) // parts)
+        return [text[i : i + size] for i in range(0, len(text), size)]
+    return pack_chunks(pieces, max_tokens, count_tokens)
+
+
+def pack_chunks(
+    pieces: List[str], max_tokens: int, count_tokens: Callable[[str], int]
+) -> List[str]:
+    """Pack consecutive pieces into chunks of at most max_tokens tokens.
+
+    Pieces are kept whole and in order where they fit; a piece larger than
+    the budget is split further on its own.
+
+    Args:
+        pieces: Consecutive pieces of text, e.g. bill sections
+        max_tokens: Maximum number of tokens per chunk
+        count_tokens: Callable returning the token count of a text
+
+    Returns:
+        List of chunks, in text order
+    """
+    chunks: List[str] = []
+    current = ""
+    current_tokens = 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if tokens > max_tokens:
+            if current:
+                chunks.append(current)
+                current, current_tokens = "", 0
+            chunks.extend(_split_oversized(piece, max_tokens, count_tokens))
+            continue
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = "", 0
+        current += piece
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunk_bill(
+    text: str, max_tokens: int, count_tokens: Callable[[str], int]
+) -> List[str]:
+    """Split bill text into section-aligned chunks within a token budget.
+
+    Args:
+        text: Raw bill text
+        max_tokens: Maximum number of tokens per chunk
+        count_tokens: Callable returning the token count of a text
+
+    Returns:
+        List of chunks, in text order
+    """
+    return pack_chunks(split_sections(text), max_tokens, count_tokens)
@@ -0,0 +1,116 @@
+# Created by Metrum AI for Dell
+"""Deterministic extraction of code section citations from bill text."""
+import re
+from typing import Iterable, List, Optional, Set, Tuple
+
+TARGET_CODE = "Health and Safety Code"
+
+NUMBER = r"\d+(?:\.\d+)*"
+
+# "Section 43013", "Sections 1234.5, 1235, and 1236", "Sections 25249.5 to
+# 25249.13, inclusive", "§ 43013" and "§§ 100 through 105".
+CITATION_PATTERN = re.compile(
+    rf"(?:\bSections?|§§?)\s+"
+    rf"(?P<ids>{NUMBER}(?:\s*(?:,\s*(?:and\s+|or\s+)?|and|or|to|through)"
+    rf"\s*{NUMBER})*)",
+    re.IGNORECASE,
+)
+# The bill's own section headings, e.g. "SECTION 1." at a line start.
+HEADING_PATTERN = re.compile(rf"(?m)^[ \t]*SECTION\s+{NUMBER}\.")
+NUMBER_PATTERN = re.compile(NUMBER)
+RANGE_PATTERN = re.compile(
+    rf"(?P<start>{NUMBER})\s*(?:to|through)\s*(?P<end>{NUMBER})",
+    re.IGNORECASE,
+)
+
+# What follows the numbers decides which code they belong to, e.g.
+# "of the Penal Code" or "of this act".
+CODE_PATTERN = re.compile(
+    r"^(?:,?\s*(?:inclusive,?\s*)?)(?:of|in)\s+(?:the\s+)?"
+    r"(?P<code>this\s+\w+|[A-Z][A-Za-z ]*?Code)\b"
+)
+
+
+def _key(section_id: str) -> Tuple[int, ...]:
+    """Return the sort key of a section ID, e.g. 25249.13 after 25249.5."""
+    return tuple(int(part) for part in section_id.split("."))
+
+
+def _expand_range(
+    start: str, end: str, known_ids: Optional[Set[str]]
+) -> List[str]:
+    """Return the known IDs between two cited IDs, both included.
+
+    Known IDs that are not plain numbers, such as ones with a letter
+    suffix, cannot be ordered against the cited IDs and are skipped.
+    """
+    if not known_ids:
+        return [start, end]
+    low, high = _key(start), _key(end)
+    return sorted(
+        (
+            section_id
+            for section_id in known_ids
+            if NUMBER_PATTERN.fullmatch(section_id)
+            and low <= _key(section_id) <= high
+        ),
+        key=_key,
+    )
+
+
+def _is_heading(text: str, start: int) -> bool:
+    """Return whether the citation at start is one of the bill's headings.
+
+    Headings are matched from the start of their line, as the citation
+    starts after any indentation, which PDF text often has.
+    """
+    line_start = text.rfind("\n", 0, start) + 1
+    heading = HEADING_PATTERN.match(text, line_start)
+    return heading is not None and start < heading.end()
+
+
+def _cited_code(text: str, end: int) -> Optional[str]:
+    """Return the code named right after a citation, if any."""
+    match = CODE_PATTERN.match(text[end : end + 100])
+    return " ".join(match.group("code").split()) if match else None
+
+
+def extract_section_ids(
+    text: str, known_ids: Optional[Iterable[str]] = None
+) -> List[str]:
+    """Extract the cited Health and Safety Code section IDs from bill text.
+
+    Citations of other codes and of the bill's own sections ("of this
+    act") are skipped. Citations that name no code are kept, as bills
+    usually name the code once for a run of citations.
+
+    Args:
+        text: Bill text
+        known_ids: IDs ingested into the collection. When given, only
+            these IDs are returned and cited ranges are expanded to them.
+
+    Returns:
+        Distinct section IDs, in order of first citation
+    """
+    known = set(known_ids) if known_ids is not None else None
+    section_ids = []
+    for match in CITATION_PATTERN.finditer(text):
+        if _is_heading(text, match.start()):
+            continue
+        code = _cited_code(text, match.end())
+        if code and code.lower() != TARGET_CODE.lower():
+            continue
+        ids = match.group("ids")
+        ranges = list(RANGE_PATTERN.finditer(ids))
+        for found in ranges:
+            section_ids.extend(
+                _expand_range(found.group("start"), found.group("end"), known)
+            )
+        ids = RANGE_PATTERN.sub(" ", ids)
+        section_ids.extend(NUMBER_PATTERN.findall(ids))
+
+    if known is not None:
+        section_ids = [
+            section_id for section_id in section_ids if section_id in known
+        ]
+    return list(dict.fromkeys(section_ids))
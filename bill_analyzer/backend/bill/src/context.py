@@ -0,0 +1,120 @@
+# Created by Metrum AI for Dell
+"""Token-budgeted, deduplicated context assembly for the agent prompts."""
+import hashlib
+import logging
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+
+from langchain_core.documents import Document
+from transformers import AutoTokenizer
+from utils import get_shared_resource, read_config_vars
+
+configs = read_config_vars(
+    {
+        "MODEL_NAME": "meta-llama/Llama-3.2-3B-Instruct",
+        "CONTEXT_TOKEN_BUDGET": "2048",
+        "STEP_CONTEXT_TOKEN_BUDGET": "512",
+    }
+)
+
+# Rough characters per token, used only if the tokenizer cannot be loaded.
+CHARS_PER_TOKEN = 4
+
+logger = logging.getLogger(__name__)
+
+
+def create_token_counter() -> Callable[[str], int]:
+    """Create a token counter backed by the served model's tokenizer."""
+    try:
+        tokenizer = AutoTokenizer.from_pretrained(configs["MODEL_NAME"])
+    except (OSError, ValueError) as error:
+        logger.warning(
+            f"Tokenizer of {configs['MODEL_NAME']} unavailable, "
+            f"estimating token counts: {error}"
+        )
+        return lambda text: len(text) // CHARS_PER_TOKEN + 1
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def count_tokens(text: str) -> int:
+    """Return the number of tokens of a text for the served model."""
+    return get_shared_resource("token_counter", create_token_counter)(text)
+
+
+def content_hash(text: str) -> str:
+    """Return the hash used to deduplicate passages by content."""
+    return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
+
+
+def build_context(
+    scored_documents: Iterable[Tuple[Document, float]],
+    budget: int,
+    exclude: Iterable[str] = (),
+) -> List[str]:
+    """Select the best distinct passages that fit in a token budget.
+
+    Passages are deduplicated by section ID and by content, ranked by
+    retrieval score, and added in rank order while they fit in the budget.
+    Passages that would overflow it are skipped.
+
+    Args:
+        scored_documents: Retrieved documents with their distance to the
+            query, lower being closer
+        budget: Maximum number of tokens of the selected passages
+        exclude: Passages already in the prompt, left out of the result
+
+    Returns:
+        Selected passages, closest first
+    """
+    seen_ids: Set[str] = set()
+    seen_hashes = {content_hash(text) for text in exclude}
+    ranked = sorted(scored_documents, key=lambda pair: pair[1])
+
+    context = []
+    used = 0
+    for document, _ in ranked:
+        section_id: Optional[str] = document.metadata.get("id")
+        digest = content_hash(document.page_content)
+        if section_id in seen_ids or digest in seen_hashes:
+            continue
+        if section_id is not None:
+            seen_ids.add(section_id)
+        seen_hashes.add(digest)
+
+        tokens = count_tokens(document.page_content)
+        if used + tokens > budget:
+            continue
+        context.append(document.page_content)
+        used += tokens
+
+    logger.info(
+        f"Built context of {len(context)} passages, {used}/{budget} tokens"
+    )
+    return context
+
+
+def build_bill_context(
+    scored_documents: Iterable[Tuple[Document, float]]
+) -> List[str]:
+    """Build the context shared by every step for a bill."""
+    return build_context(
+        scored_documents, int(configs["CONTEXT_TOKEN_BUDGET"])
+    )
+
+
+def build_step_context(
+    documents: Iterable[Document], bill_context: Iterable[str]
+) -> List[str]:
+    """Build a step's own context, leaving out the bill's context.
+
+    Args:
+        documents: Documents retrieved for the step, closest first
+        bill_context: Context shared by every step for the bill
+
+    Returns:
+        Selected passages of the step
+    """
+    return build_context(
+        ((document, rank) for rank, document in enumerate(documents)),
+        int(configs["STEP_CONTEXT_TOKEN_BUDGET"]),
+        exclude=bill_context,
+    )
@@ -0,0 +1,160 @@
+# Created by Metrum AI for Dell
+"""Adaptive concurrency control of in-flight pipelines from vLLM metrics."""
+import logging
+import math
+import time
+from typing import Callable, Dict, Optional
+
+from metric import get_live_vllm_metrics
+from utils import read_config_vars
+
+configs = read_config_vars(
+    {
+        "CONTROLLER_MIN": "1",
+        "CONTROLLER_MAX": "64",
+        "CONTROLLER_INTERVAL": "15",
+        "CONTROLLER_MAX_WAITING": "16",
+        "CONTROLLER_LATENCY_FACTOR": "2.0",
+        "CONTROLLER_DECREASE": "0.5",
+        "CONTROLLER_PROBE_AFTER": "4",
+    }
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _value(metrics: Dict[str, Optional[float]], key: str) -> Optional[float]:
+    """Return a metric value, treating missing and NaN samples as None."""
+    value = metrics.get(key)
+    if value is None or math.isnan(value):
+        return None
+    return value
+
+
+class AIMDController:
+    """Additive-increase, multiplicative-decrease limit on in-flight work.
+
+    The limit grows by one pipeline while vLLM's generation throughput keeps
+    improving, and is cut multiplicatively as soon as the vLLM queue grows
+    past CONTROLLER_MAX_WAITING or the request latency exceeds
+    CONTROLLER_LATENCY_FACTOR times the lowest latency seen. When neither
+    happens but throughput stops improving, the limit is held; after
+    CONTROLLER_PROBE_AFTER holds in a row, it probes one pipeline higher
+    and takes the current throughput as the new target, so a plateau is
+    left once more capacity is available.
+
+    Decisions are driven by calls to update, which callers make on every
+    completion and at least every interval while work is in flight.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: Optional[int] = None,
+        maximum: Optional[int] = None,
+        interval: Optional[float] = None,
+        read_metrics: Callable[
+            [], Dict[str, Optional[float]]
+        ] = get_live_vllm_metrics,
+        log: Optional[logging.Logger] = None,
+    ):
+        """Initialize the controller.
+
+        Args:
+            initial: Starting number of in-flight pipelines
+            minimum: Lowest limit, defaults to CONTROLLER_MIN
+            maximum: Highest limit, defaults to CONTROLLER_MAX
+            interval: Minimum seconds between decisions, defaults to
+                CONTROLLER_INTERVAL
+            read_metrics: Callable returning the live vLLM metrics
+            log: Logger for the decisions, defaults to the module logger
+        """
+        self.minimum = minimum or int(configs["CONTROLLER_MIN"])
+        self.maximum = maximum or int(configs["CONTROLLER_MAX"])
+        self.interval = (
+            interval
+            if interval is not None
+            else float(configs["CONTROLLER_INTERVAL"])
+        )
+        self.max_waiting = float(configs["CONTROLLER_MAX_WAITING"])
+        self.latency_factor = float(configs["CONTROLLER_LATENCY_FACTOR"])
+        self.decrease = float(configs["CONTROLLER_DECREASE"])
+        self.probe_after = int(configs["CONTROLLER_PROBE_AFTER"])
+        self.read_metrics = read_metrics
+        self.logger = log or logger
+        self.limit = max(self.minimum, min(self.maximum, initial))
+        self.best_throughput = 0.0
+        self.base_latency: Optional[float] = None
+        self.holds = 0
+        self._last_decision = 0.0
+
+    def update(self) -> int:
+        """Re-evaluate the limit from the live metrics and log the decision.
+
+        Decisions are taken at most once per interval; calls in between
+        return the current limit unchanged.
+
+        Returns:
+            Number of pipelines allowed in flight
+        """
+        now = time.monotonic()
+        if now - self._last_decision < self.interval:
+            return self.limit
+        self._last_decision = now
+
+        metrics = self.read_metrics()
+        waiting = _value(metrics, "waiting")
+        throughput = _value(metrics, "throughput")
+        latency = _value(metrics, "latency")
+        if latency is not None:
+            self.base_latency = min(self.base_latency or latency, latency)
+
+        previous = self.limit
+        if waiting is not None and waiting > self.max_waiting:
+            decision = "decrease"
+            reason = f"{waiting:.0f} requests waiting"
+        elif (
+            latency is not None
+            and latency > self.latency_factor * self.base_latency
+        ):
+            decision = "decrease"
+            reason = (
+                f"latency {latency:.2f}s above "
+                f"{self.latency_factor} x {self.base_latency:.2f}s"
+            )
+        elif throughput is None:
+            decision = "hold"
+            reason = "no throughput sample"
+        elif throughput > self.best_throughput:
+            decision = "increase"
+            reason = f"throughput up to {throughput:.1f} tokens/s"
+            self.best_throughput = throughput
+        elif self.holds >= self.probe_after:
+            decision = "probe"
+            reason = (
+                f"throughput held at {throughput:.1f} tokens/s for "
+                f"{self.holds} decisions"
+            )
+            self.best_throughput = throughput
+        else:
+            decision = "hold"
+            reason = (
+                f"throughput {throughput:.1f} tokens/s not above "
+                f"{self.best_throughput:.1f} tokens/s"
+            )
+
+        self.holds = self.holds + 1 if decision == "hold" else 0
+        if decision in ("increase", "probe"):
+            self.limit = min(self.maximum, self.limit + 1)
+        elif decision == "decrease":
+            self.limit = max(
+                self.minimum, math.floor(self.limit * self.decrease)
+            )
+            # Throughput seen at the old limit is no longer a fair target.
+            self.best_throughput = throughput or 0.0
+
+        self.logger.info(
+            f"Concurrency {decision}: {previous} -> {self.limit} ({reason}); "
+            f"metrics: {metrics}"
+        )
+        return self.limit
@@ -1,6 +1,7 @@
 # Created by Metrum AI for Dell
 """Module for orchestrating bill analysis workflow using Prefect."""
-from typing import Any, Dict, Tuple
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
 
 from agents.ebi_agent import EBIAgent
 from agents.lac_agent import LACAgent
@@ -9,8 +10,34 @@ from generator import GENAgent
 from langchain_openai import ChatOpenAI
 from prefect import flow, task
 from prefect.artifacts import create_markdown_artifact
-from rag import get_bill, get_list
-from utils import create_llm_model, read_config_vars
+from prefect.futures import as_completed
+from prefect.logging import get_run_logger
+from prefect.runtime import flow_run
+from rag import aget_list, get_bill, get_list
+from rerank import get_reranker, rerank_enabled
+from utils import (
+    close_async_llm_model,
+    get_async_llm_model,
+    get_llm_cache,
+    get_llm_model,
+    read_config_vars,
+    warm_up_resources,
+)
+
+AGENT_NAMES = {
+    "legal": "Legal and Compliance Agent",
+    "social": "Social and Environmental Impact Agent",
+    "economic": "Economic and Budgetary Impact Agent",
+}
+
+
+def warm_up() -> None:
+    """Build the shared resources and retrieval cache used by agent_flow."""
+    warm_up_resources()
+    if rerank_enabled():
+        get_reranker()
+    for agent in (LACAgent, SEIAgent, EBIAgent):
+        agent.warm_up()
 
 
 @task(name="Preprocessing")
@@ -28,124 +55,345 @@ def rag(bill: str, llm: Any = None) -> Tuple[str, str]:
 
 
 @task(name="Legal and Compliance Agent")
-def lac(bill: str, context: str, llm: Any = None) -> str:
+def lac(
+    bill: str,
+    context: str,
+    llm: Any = None,
+    stream_key: Optional[str] = None,
+) -> str:
     """Run Legal and Compliance analysis.
 
     Args:
         bill: Bill text
         context: Context from RAG
         llm: Optional language model
+        stream_key: Optional output key to stream tokens to
 
     Returns:
         Analysis report string
     """
     agent = LACAgent(llm)
-    return agent.run(bill, context)
+    return agent.run(bill, context, stream_key)
 
 
 @task(name="Social and Environmental Impact Agent")
-def sei(bill: str, context: str, llm: Any = None) -> str:
+def sei(
+    bill: str,
+    context: str,
+    llm: Any = None,
+    stream_key: Optional[str] = None,
+) -> str:
     """Run Social and Environmental Impact analysis.
 
     Args:
         bill: Bill text
         context: Context from RAG
         llm: Optional language model
+        stream_key: Optional output key to stream tokens to
 
     Returns:
         Analysis report string
     """
     agent = SEIAgent(llm)
-    return agent.run(bill, context)
+    return agent.run(bill, context, stream_key)
 
 
 @task(name="Economic and Budgetary Impact Agent")
-def eai(bill: str, context: str, llm: Any = None) -> str:
+def eai(
+    bill: str,
+    context: str,
+    llm: Any = None,
+    stream_key: Optional[str] = None,
+) -> str:
     """Run Economic and Budgetary Impact analysis.
 
     Args:
         bill: Bill text
         context: Context from RAG
         llm: Optional language model
+        stream_key: Optional output key to stream tokens to
 
     Returns:
         Analysis report string
     """
     agent = EBIAgent(llm)
-    return agent.run(bill, context)
+    return agent.run(bill, context, stream_key)
 
 
 @task(name="Report Generation")
-def report(bill: str, analysis: Dict[str, str], llm: Any = None) -> str:
+def report(
+    bill: str,
+    analysis: Dict[str, str],
+    llm: Any = None,
+    stream_key: Optional[str] = None,
+    context: Optional[List[str]] = None,
+) -> str:
     """Generate final analysis report.
 
     Args:
         bill: Bill text
         analysis: Dictionary of agent analysis reports
         llm: Optional language model
+        stream_key: Optional output key to stream tokens to
+        context: Optional context shared with the agents' prompts
 
     Returns:
         Final report string
     """
     agent = GENAgent(llm)
-    return agent.run(bill, analysis)
+    return agent.run(bill, analysis, stream_key, context)
+
+
+@task(name="Preprocessing")
+async def rag_async(bill: str, llm: Any = None) -> Tuple[str, str]:
+    """Perform RAG preprocessing on bill text asynchronously.
+
+    Args:
+        bill: Input bill text
+        llm: Optional language model
+
+    Returns:
+        Tuple of processed bill text and context
+    """
+    return await aget_list(bill, llm)
+
+
+@task(name="Legal and Compliance Agent")
+async def lac_async(
+    bill: str,
+    context: str,
+    llm: Any = None,
+    stream_key: Optional[str] = None,
+) -> str:
+    """Run Legal and Compliance analysis asynchronously."""
+    return await LACAgent(llm).arun(bill, context, stream_key)
+
+
+@task(name="Social and Environmental Impact Agent")
+async def sei_async(
+    bill: str,
+    context: str,
+    llm: Any = None,
+    stream_key: Optional[str] = None,
+) -> str:
+    """Run Social and Environmental Impact analysis asynchronously."""
+    return await SEIAgent(llm).arun(bill, context, stream_key)
+
+
+@task(name="Economic and Budgetary Impact Agent")
+async def eai_async(
+    bill: str,
+    context: str,
+    llm: Any = None,
+    stream_key: Optional[str] = None,
+) -> str:
+    """Run Economic and Budgetary Impact analysis asynchronously."""
+    return await EBIAgent(llm).arun(bill, context, stream_key)
+
+
+@task(name="Report Generation")
+async def report_async(
+    bill: str,
+    analysis: Dict[str, str],
+    llm: Any = None,
+    stream_key: Optional[str] = None,
+    context: Optional[List[str]] = None,
+) -> str:
+    """Generate final analysis report asynchronously."""
+    return await GENAgent(llm).arun(bill, analysis, stream_key, context)
+
+
+def artifact_key(key: str, replica: int, batch: Optional[str]) -> str:
+    """Return the artifact key of an output of a replica.
+
+    Replica runs keep the plain keys read by the frontend (e.g.
+    "legal-1"), while bills of a batch are namespaced by the batch, so
+    batches never overwrite each other's or the replica runs' artifacts.
+
+    Args:
+        key: Output name (e.g. "legal")
+        replica: Replica number, or index of the bill in its batch
+        batch: Flow run ID of the batch, if any
+    """
+    return f"{key}-{batch}-{replica}" if batch else f"{key}-{replica}"
+
+
+def stream_key(key: str) -> str:
+    """Return the token stream key of an output of the current flow run.
+
+    Streams are keyed by the flow run ID of the replica, as returned by
+    /get_replica_ids, so concurrent runs and batches never share one.
+
+    Args:
+        key: Output name (e.g. "legal")
+    """
+    return f"{flow_run.id}:{key}"
+
+
+def log_llm_cache_stats() -> None:
+    """Log the hit and miss counters of the LLM response cache."""
+    llm_cache = get_llm_cache()
+    if llm_cache:
+        get_run_logger().info("LLM response cache: %s", llm_cache.stats())
 
 
 @flow
-def agent_flow(bill_path: str, replica: int) -> str:
+def agent_flow(
+    bill_path: str, replica: int, batch: Optional[str] = None
+) -> str:
     """Main workflow for bill analysis.
 
     Args:
         bill_path: Path to bill file
         replica: Replica number for parallel runs
+        batch: Flow run ID of the batch the bill belongs to, if any
 
     Returns:
         Final analysis report
     """
-    llm = create_llm_model()
+    llm = get_llm_model()
 
     bill = get_bill(bill_path)
     rag_out = rag.submit(bill, llm)
     bill_str, context = rag_out.result()
 
     create_markdown_artifact(
-        key=f"bill-{replica}",
+        key=artifact_key("bill", replica, batch),
         markdown="\n" + bill_str,
         description="Structured Bill",
     )
 
-    lac_out = lac.submit(bill, context, llm, wait_for=[rag_out])
-    create_markdown_artifact(
-        key=f"legal-{replica}",
-        markdown="\n\n" + lac_out.result(),
-        description="Legal and Compliance Agent Report",
-    )
-
-    sei_out = sei.submit(bill_str, context, llm, wait_for=[lac_out])
-    create_markdown_artifact(
-        key=f"social-{replica}",
-        markdown="\n\n" + sei_out.result(),
-        description="Social and Environmental Impact Agent Report",
-    )
-
-    eai_out = eai.submit(bill_str, context, llm, wait_for=[rag_out])
-    create_markdown_artifact(
-        key=f"economic-{replica}",
-        markdown="\n\n" + eai_out.result(),
-        description="Economic and Budgetary Impact Agent Report",
-    )
+    # The agents are independent of each other, so they all fan out as soon
+    # as preprocessing is done and fan back in at the report. All of them
+    # get the structured bill, so every call shares the same prompt prefix.
+    agent_runs = {
+        "legal": lac.submit(
+            bill_str, context, llm, stream_key("legal"), wait_for=[rag_out]
+        ),
+        "social": sei.submit(
+            bill_str, context, llm, stream_key("social"), wait_for=[rag_out]
+        ),
+        "economic": eai.submit(
+            bill_str, context, llm, stream_key("economic"), wait_for=[rag_out]
+        ),
+    }
+    run_keys = {
+        future.task_run_id: key for key, future in agent_runs.items()
+    }
+    for future in as_completed(list(agent_runs.values())):
+        key = run_keys[future.task_run_id]
+        create_markdown_artifact(
+            key=artifact_key(key, replica, batch),
+            markdown="\n\n" + future.result(),
+            description=f"{AGENT_NAMES[key]} Report",
+        )
 
     analysis = {
-        "Legal and Compliance Agent": lac_out.result(),
-        "Social and Environmental Impact Agent": sei_out.result(),
-        "Economic and Budgetary Impact Agent": eai_out.result(),
+        AGENT_NAMES[key]: future.result()
+        for key, future in agent_runs.items()
     }
 
-    report_out = report.submit(bill_str, analysis, llm, wait_for=[eai_out])
+    report_out = report.submit(
+        bill_str,
+        analysis,
+        llm,
+        stream_key("report"),
+        context,
+        wait_for=list(agent_runs.values()),
+    )
     create_markdown_artifact(
-        key=f"report-{replica}",
+        key=artifact_key("report", replica, batch),
         markdown=report_out.result(),
         description="Report",
     )
 
+    log_llm_cache_stats()
+
     return report_out.result()
+
+
+@flow
+async def agent_flow_async(
+    bill_path: str, replica: int, batch: Optional[str] = None
+) -> str:
+    """Asyncio-native workflow for bill analysis.
+
+    Every LLM and retriever call is awaited on the running event loop
+    instead of occupying a worker thread, so replicas gathered on one
+    loop by agent_flows_async share a single process and client.
+
+    Args:
+        bill_path: Path to bill file
+        replica: Replica number for parallel runs
+        batch: Flow run ID of the batch the bill belongs to, if any
+
+    Returns:
+        Final analysis report
+    """
+    llm = get_async_llm_model()
+
+    bill = await asyncio.to_thread(get_bill, bill_path)
+    bill_str, context = await rag_async(bill, llm)
+
+    await create_markdown_artifact(
+        key=artifact_key("bill", replica, batch),
+        markdown="\n" + bill_str,
+        description="Structured Bill",
+    )
+
+    async def run_agent(key: str, agent_task: Any) -> str:
+        result = await agent_task(bill_str, context, llm, stream_key(key))
+        await create_markdown_artifact(
+            key=artifact_key(key, replica, batch),
+            markdown="\n\n" + result,
+            description=f"{AGENT_NAMES[key]} Report",
+        )
+        return result
+
+    results = await asyncio.gather(
+        run_agent("legal", lac_async),
+        run_agent("social", sei_async),
+        run_agent("economic", eai_async),
+    )
+    analysis = dict(zip(AGENT_NAMES.values(), results))
+
+    report_out = await report_async(
+        bill_str, analysis, llm, stream_key("report"), context
+    )
+    await create_markdown_artifact(
+        key=artifact_key("report", replica, batch),
+        markdown=report_out,
+        description="Report",
+    )
+
+    log_llm_cache_stats()
+
+    return report_out
+
+
+async def agent_flows_async(
+    bill_path: str, replicas: List[int], batch: Optional[str] = None
+) -> List[str]:
+    """Run replicas of the asyncio-native workflow on the running loop.
+
+    This is the entry point of a worker thread's event loop: the
+    replicas share the loop's LLM client, which is closed once they
+    finish.
+
+    Args:
+        bill_path: Path to bill file
+        replicas: Replica numbers to run
+        batch: Flow run ID of the batch the bill belongs to, if any
+
+    Returns:
+        Final analysis reports, in the order of the replicas
+    """
+    try:
+        return await asyncio.gather(
+            *(
+                agent_flow_async(bill_path, replica, batch)
+                for replica in replicas
+            )
+        )
+    finally:
+        await close_async_llm_model()
@@ -1,22 +1,17 @@
 # Created by Metrum AI for Dell
 """Generator Agent module for synthesizing analysis reports."""
-from typing import TypedDict
+from typing import List, Optional, TypedDict
 
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
 from langchain_openai import ChatOpenAI
 from langgraph.graph import END, START, StateGraph
-from utils import create_llm_model, read_config_vars
+from prompts import build_prompt, format_context
+from streaming import close_streams, stream_callbacks
+from utils import get_llm_model, read_config_vars
 
 SYNTHESIS_PROMPT = """Synthesize the findings from three agents—Legal and Compliance Agent,
 Social and Environmental Impact Agent, and
 Economic and Budgetary Impact Agent—into a final bill analysis report.
--------------------------
-ANALYSIS FROM AGENTS
-{analysis}
--------------------------
-BILL
-{bill}
--------------------------
 
 Structured Output:
 Introduction: Summarize the bill's purpose, key objectives, scope, and public relevance.
@@ -35,6 +30,7 @@ class OverallState(TypedDict):
     """State type for the generator workflow."""
 
     bill: str
+    context: List[str]
     analysis: str
     output: str
 
@@ -47,13 +43,36 @@ class GENAgent:
         Args:
             llm: Optional language model to use
         """
-        self.model = llm if llm else create_llm_model()
+        self.model = llm if llm else get_llm_model()
         graph = StateGraph(OverallState)
-        graph.add_node("synthesis", self._synthesize)
+        graph.add_node(
+            "synthesis",
+            RunnableLambda(self._synthesize, afunc=self._asynthesize),
+        )
         graph.add_edge(START, "synthesis")
         graph.add_edge("synthesis", END)
         self.agent = graph.compile()
 
+    def _build_chain(self):
+        """Build the synthesis chain.
+
+        The prompt shares the agents' per-bill prefix, so the bill and its
+        context are already in vLLM's prefix cache when the report runs.
+        """
+        prompt = build_prompt(
+            SYNTHESIS_PROMPT, [("ANALYSIS FROM AGENTS", "analysis")]
+        )
+        return prompt | self.model
+
+    @staticmethod
+    def _synthesis_inputs(state: OverallState) -> dict:
+        """Build the prompt inputs of the synthesis."""
+        return {
+            "bill": state["bill"],
+            "context": format_context(state["context"]),
+            "analysis": state["analysis"],
+        }
+
     def _synthesize(self, state: OverallState) -> dict:
         """Synthesize the analysis reports.
 
@@ -63,26 +82,71 @@ class GENAgent:
         Returns:
             Dict containing synthesized output
         """
-        prompt = ChatPromptTemplate.from_messages(
-            [("human", SYNTHESIS_PROMPT)]
-        )
-        chain = prompt | self.model
-        response = chain.invoke(
-            {"bill": state["bill"], "analysis": state["analysis"]}
+        response = self._build_chain().invoke(self._synthesis_inputs(state))
+        return {"output": response.content}
+
+    async def _asynthesize(self, state: OverallState) -> dict:
+        """Synthesize the analysis reports asynchronously.
+
+        Args:
+            state: Current workflow state
+
+        Returns:
+            Dict containing synthesized output
+        """
+        response = await self._build_chain().ainvoke(
+            self._synthesis_inputs(state)
         )
         return {"output": response.content}
 
-    def run(self, bill: str, analysis: str) -> str:
+    def run(
+        self,
+        bill: str,
+        analysis: str,
+        stream_key: Optional[str] = None,
+        context: Optional[List[str]] = None,
+    ) -> str:
         """Run the generator workflow.
 
         Args:
             bill: Bill text
             analysis: Combined analysis from other agents
+            stream_key: Optional output key to stream tokens to
+            context: Optional context shared with the agents' prompts
 
         Returns:
             Synthesized analysis report
         """
+        callbacks = stream_callbacks(stream_key)
         analysis_result = self.agent.invoke(
-            {"bill": bill, "analysis": analysis}
+            {"bill": bill, "context": context or [], "analysis": analysis},
+            config={"callbacks": callbacks},
+        )
+        close_streams(callbacks, analysis_result["output"])
+        return analysis_result["output"]
+
+    async def arun(
+        self,
+        bill: str,
+        analysis: str,
+        stream_key: Optional[str] = None,
+        context: Optional[List[str]] = None,
+    ) -> str:
+        """Run the generator workflow asynchronously.
+
+        Args:
+            bill: Bill text
+            analysis: Combined analysis from other agents
+            stream_key: Optional output key to stream tokens to
+            context: Optional context shared with the agents' prompts
+
+        Returns:
+            Synthesized analysis report
+        """
+        callbacks = stream_callbacks(stream_key)
+        analysis_result = await self.agent.ainvoke(
+            {"bill": bill, "context": context or [], "analysis": analysis},
+            config={"callbacks": callbacks},
         )
+        close_streams(callbacks, analysis_result["output"])
         return analysis_result["output"]
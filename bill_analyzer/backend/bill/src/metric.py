@@ -12,6 +12,8 @@ configs = read_config_vars(
     }
 )
 
+VLLM_INSTANCES = 'instance=~"vllm_serving_0:8000|vllm_serving_1:8000"'
+
 logger = logging.getLogger(__name__)
 
 
@@ -57,10 +59,50 @@ def get_average_metric(query, start_time, end_time, step=60):
     return None
 
 
+def get_current_metric(query):
+    """
+    Fetches the current value of a Prometheus metric.
+
+    Parameters:
+        query (str): The PromQL query to retrieve the metric.
+
+    Returns:
+        float: The sum of the current values of the query's series, or None if no data is available.
+    """
+    try:
+        response = requests.get(
+            f"{configs['PROMETHEUS_URL']}/api/v1/query",
+            params={"query": query},
+            timeout=10,
+        )
+        data = response.json()
+    except (requests.RequestException, ValueError) as error:
+        logger.error("Error querying Prometheus: %s", error)
+        return None
+    if data["status"] == "success":
+        results = data["data"]["result"]
+        if not results:
+            return None
+        return sum(float(result["value"][1]) for result in results)
+    logger.error("Error querying Prometheus: %s", data)
+    return None
+
+
+def get_live_vllm_metrics():
+    """Fetches the current queue depth, throughput and latency of vLLM."""
+    metrics = {
+        "waiting": f"sum(vllm:num_requests_waiting{{{VLLM_INSTANCES}}})",
+        "running": f"sum(vllm:num_requests_running{{{VLLM_INSTANCES}}})",
+        "throughput": f"sum(vllm:avg_generation_throughput_toks_per_s{{{VLLM_INSTANCES}}})",
+        "latency": f"sum(rate(vllm:e2e_request_latency_seconds_sum{{{VLLM_INSTANCES}}}[30s])) / sum(rate(vllm:e2e_request_latency_seconds_count{{{VLLM_INSTANCES}}}[30s]))",
+    }
+    return {key: get_current_metric(value) for key, value in metrics.items()}
+
+
 def get_average_metrics(start_time, end_time):
     """Fetches average metrics for throughput, utilization, and power."""
     metrics = {
-        "throughput": 'sum(vllm:avg_generation_throughput_toks_per_s{instance=~"vllm_serving_0:8000|vllm_serving_1:8000"})',
+        "throughput": f"sum(vllm:avg_generation_throughput_toks_per_s{{{VLLM_INSTANCES}}})",
         "util": '100*(1-avg by(instance)(rate(node_cpu_seconds_total{mode="idle"}[20s])))',
         "power": "sum(socket_power)",
     }
@@ -0,0 +1,59 @@
+# Created by Metrum AI for Dell
+"""Prompt assembly that keeps a byte-identical prefix across LLM calls.
+
+Every agent step, recommendation and report call for a bill starts with the
+same system message, bill and shared context, and appends its own sections
+and instruction after them. vLLM's automatic prefix caching then prefills
+the shared part once per bill instead of once per call.
+"""
+from typing import Iterable, Sequence, Tuple
+
+from langchain_core.prompts import ChatPromptTemplate
+
+SYSTEM_MESSAGE = (
+    "You are an Intelligent Assistant who follows instructions properly."
+)
+
+SEPARATOR = "-----------------------------------------------"
+
+SHARED_PREFIX = f"""BILL
+{{bill}}
+{SEPARATOR}
+CONTEXT
+{{context}}
+{SEPARATOR}
+"""
+
+
+def format_context(context: Iterable[str]) -> str:
+    """Render context passages as one block of text.
+
+    Args:
+        context: Context passages, in a deterministic order
+
+    Returns:
+        Passages separated by blank lines
+    """
+    return "\n\n".join(context)
+
+
+def build_prompt(
+    instruction: str, sections: Sequence[Tuple[str, str]] = ()
+) -> ChatPromptTemplate:
+    """Build a prompt that starts with the shared per-bill prefix.
+
+    Args:
+        instruction: Call-specific instruction, placed last
+        sections: (title, variable) pairs of call-specific inputs placed
+            between the shared prefix and the instruction
+
+    Returns:
+        Prompt template with "bill", "context" and the section variables
+    """
+    body = SHARED_PREFIX
+    for title, variable in sections:
+        body += f"{title}\n{{{variable}}}\n{SEPARATOR}\n"
+    body += instruction
+    return ChatPromptTemplate.from_messages(
+        [("system", SYSTEM_MESSAGE), ("human", body)]
+    )
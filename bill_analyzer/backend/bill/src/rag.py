@@ -1,16 +1,28 @@
 # Created by Metrum AI for Dell
 """RAG module for bill analysis and retrieval."""
+import asyncio
 import logging
-from typing import List, Optional, Tuple
+from typing import FrozenSet, List, Optional, Tuple
 
+from cache import BillTextStore
+from chunking import chunk_bill
+from citations import extract_section_ids
+from context import count_tokens
 from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_milvus import Milvus
 from langchain_openai import ChatOpenAI
 from pydantic import BaseModel, Field
-from utils import create_llm_model, create_milvus_connection, read_config_vars
+from rerank import build_reranked_context
+from retrieval import ingested_ids, lookup_section_ids
+from utils import (
+    get_llm_model,
+    get_shared_resource,
+    read_config_vars,
+)
 
 
 class Query(BaseModel):
@@ -48,13 +60,152 @@ BILL
 {bill}
 """
 
+MERGE_PROMPT = """
+The following are structured summaries of consecutive parts of the same
+legislative bill, in order. Merge them into one structured summary of the
+whole bill with the headings below. Keep every section from every part,
+in order, and drop repeated points.
+
+Title and Reference Number
+Purpose of the Bill (brief summary)
+Key Provisions (Extract all the available sections)
+Affected Parties (who is impacted)
+Penalties/Enforcement (if applicable)
+Effective Date (when it starts)
+Keep the output clear and organized in bullet points.
+--------------------------------
+PARTS
+{parts}
+"""
+
+configs = read_config_vars(
+    {
+        "BILL_CACHE_SIZE": "64",
+        "BILL_CACHE_DIR": "/tmp/bill_cache",
+        "MODEL_CONTEXT_LENGTH": "8192",
+        "STRUCT_OUTPUT_TOKENS": "1024",
+        "STRUCT_CHUNK_TOKENS": "2048",
+        "STRUCT_CONCURRENCY": "8",
+        "SECTION_ID_LLM_FALLBACK": "false",
+    }
+)
+
 # Add logger configuration
 logger = logging.getLogger(__name__)
 
 
+def get_bill_store() -> BillTextStore:
+    """Return the process-wide parsed bill store."""
+    return get_shared_resource(
+        "bill_store",
+        lambda: BillTextStore(
+            int(configs["BILL_CACHE_SIZE"]), configs["BILL_CACHE_DIR"] or None
+        ),
+    )
+
+
+def _build_struct_chain(
+    llm: Optional[ChatOpenAI] = None, chunked: bool = False
+):
+    """Build the chain that structures raw bill text.
+
+    Args:
+        llm: Optional language model to use
+        chunked: Whether the text is one chunk of a longer bill. Only
+            chunk outputs are capped at STRUCT_OUTPUT_TOKENS, so they fit
+            in the merge prompt; a bill structured in one call is not.
+    """
+    model = llm if llm else get_llm_model()
+    prompt = ChatPromptTemplate.from_messages([("human", REDUCTION_PROMPT)])
+    if chunked:
+        model = model.bind(max_tokens=int(configs["STRUCT_OUTPUT_TOKENS"]))
+    return prompt | model
+
+
+def _build_merge_chain(llm: Optional[ChatOpenAI] = None):
+    """Build the chain that merges structured parts of a bill."""
+    model = llm if llm else get_llm_model()
+    prompt = ChatPromptTemplate.from_messages([("human", MERGE_PROMPT)])
+    return prompt | model.bind(
+        max_tokens=int(configs["STRUCT_OUTPUT_TOKENS"])
+    )
+
+
+def struct_chunk_tokens() -> int:
+    """Return the token budget of a bill chunk.
+
+    The budget is STRUCT_CHUNK_TOKENS, capped so that a chunk, the prompt
+    around it and the structured output fit in the model's context.
+    """
+    prompt_tokens = max(
+        count_tokens(REDUCTION_PROMPT), count_tokens(MERGE_PROMPT)
+    )
+    fits = (
+        int(configs["MODEL_CONTEXT_LENGTH"])
+        - int(configs["STRUCT_OUTPUT_TOKENS"])
+        - prompt_tokens
+    )
+    return max(1, min(int(configs["STRUCT_CHUNK_TOKENS"]), fits))
+
+
+def _merge_groups(parts: List[str], max_tokens: int) -> List[List[str]]:
+    """Group consecutive structured parts that fit in one merge call.
+
+    Every group but possibly the last holds at least two parts, so each
+    merge round at least halves the number of parts. A last group of one
+    part is carried to the next round without a merge call.
+    """
+    groups: List[List[str]] = []
+    group_tokens = 0
+    for part in parts:
+        tokens = count_tokens(part)
+        if groups and (
+            len(groups[-1]) == 1 or group_tokens + tokens <= max_tokens
+        ):
+            groups[-1].append(part)
+            group_tokens += tokens
+        else:
+            groups.append([part])
+            group_tokens = tokens
+    return groups
+
+
+def _merge_inputs(groups: List[List[str]]) -> List[dict]:
+    """Build the merge prompt inputs of each group of several parts."""
+    return [
+        {
+            "parts": "\n--------------------------------\n".join(
+                f"PART {index}\n{part}"
+                for index, part in enumerate(group, start=1)
+            )
+        }
+        for group in groups
+        if len(group) > 1
+    ]
+
+
+def _merged_parts(groups: List[List[str]], responses: List) -> List[str]:
+    """Return the parts left after a merge round, in bill order.
+
+    Args:
+        groups: Groups of the round, from _merge_groups
+        responses: Merge responses of the groups of several parts
+    """
+    merged = iter(responses)
+    return [
+        group[0] if len(group) == 1 else next(merged).content
+        for group in groups
+    ]
+
+
 def get_struct_bill(raw_bill: str, llm: Optional[ChatOpenAI] = None) -> str:
     """Structure bill content into organized format.
 
+    Long bills are split into section-aligned chunks that are structured
+    in parallel, and the structured chunks are merged in parallel rounds
+    until one summary is left, so latency follows the longest chunk
+    rather than the size of the bill.
+
     Args:
         raw_bill: Raw bill text
         llm: Optional language model to use
@@ -62,27 +213,61 @@ def get_struct_bill(raw_bill: str, llm: Optional[ChatOpenAI] = None) -> str:
     Returns:
         Structured bill content
     """
-    model = llm if llm else create_llm_model()
-    prompt = ChatPromptTemplate.from_messages([("human", REDUCTION_PROMPT)])
-    chain = prompt | model
-    response = chain.invoke({"bill": raw_bill})
-    return response.content
+    max_tokens = struct_chunk_tokens()
+    batch_config = {"max_concurrency": int(configs["STRUCT_CONCURRENCY"])}
+    chunks = chunk_bill(raw_bill, max_tokens, count_tokens) or [raw_bill]
+    logger.info(f"Structuring bill in {len(chunks)} chunks")
+    responses = _build_struct_chain(llm, len(chunks) > 1).batch(
+        [{"bill": chunk} for chunk in chunks], config=batch_config
+    )
+    parts = [response.content for response in responses]
+    merge_chain = _build_merge_chain(llm)
+    while len(parts) > 1:
+        groups = _merge_groups(parts, max_tokens)
+        responses = merge_chain.batch(
+            _merge_inputs(groups), config=batch_config
+        )
+        parts = _merged_parts(groups, responses)
+    return parts[0]
 
 
-def get_list(
+async def aget_struct_bill(
     raw_bill: str, llm: Optional[ChatOpenAI] = None
-) -> Tuple[str, List[str]]:
-    """Extract section IDs and retrieve relevant context.
+) -> str:
+    """Structure bill content into organized format asynchronously.
 
     Args:
-        raw_bill: Bill text
-        llm: Optional language model
+        raw_bill: Raw bill text
+        llm: Optional language model to use
 
     Returns:
-        Tuple of structured bill and context list
+        Structured bill content
     """
-    model = llm if llm else create_llm_model()
-    structured_bill = get_struct_bill(raw_bill, llm)
+    max_tokens = struct_chunk_tokens()
+    batch_config = {"max_concurrency": int(configs["STRUCT_CONCURRENCY"])}
+    chunks = chunk_bill(raw_bill, max_tokens, count_tokens) or [raw_bill]
+    logger.info(f"Structuring bill in {len(chunks)} chunks")
+    responses = await _build_struct_chain(llm, len(chunks) > 1).abatch(
+        [{"bill": chunk} for chunk in chunks], config=batch_config
+    )
+    parts = [response.content for response in responses]
+    merge_chain = _build_merge_chain(llm)
+    while len(parts) > 1:
+        groups = _merge_groups(parts, max_tokens)
+        responses = await merge_chain.abatch(
+            _merge_inputs(groups), config=batch_config
+        )
+        parts = _merged_parts(groups, responses)
+    return parts[0]
+
+
+def _build_id_chain(llm: Optional[ChatOpenAI] = None):
+    """Build the chain that extracts section IDs from a structured bill.
+
+    Returns:
+        Tuple of the chain and the parser for its output
+    """
+    model = llm if llm else get_llm_model()
     parser = PydanticOutputParser(pydantic_object=Query)
     prompt = ChatPromptTemplate.from_messages(
         [
@@ -94,27 +279,134 @@ def get_list(
             ("human", RAG_PROMPT),
         ]
     ).partial(format_instructions=parser.get_format_instructions())
-    chain = prompt | model
-    response = chain.invoke({"bill": structured_bill})
+    return prompt | model, parser
+
+
+def _parse_ids(parser: PydanticOutputParser, content: str) -> List[str]:
+    """Parse the section IDs out of the extraction chain's response."""
     try:
-        response = parser.invoke(response.content)
-        context = []
-        vector_store = create_milvus_connection()
-        ids = list(set(response.id))
+        response = parser.invoke(content)
+        # Keep first-seen order so every replica builds the same context,
+        # and with it the same cacheable prompt prefix.
+        return list(dict.fromkeys(response.id))
     except (ValueError, TypeError) as error:
         logger.error(f"Error parsing response: {error}")
-        ids = response.content.split(",")
+        return content.split(",")
+
+
+def _llm_section_ids(
+    structured_bill: str,
+    llm: Optional[ChatOpenAI],
+    known_ids: Optional[FrozenSet[str]],
+) -> List[str]:
+    """Extract section IDs with the LLM, keeping only ingested ones."""
+    chain, parser = _build_id_chain(llm)
+    response = chain.invoke({"bill": structured_bill})
+    return _validate_ids(_parse_ids(parser, response.content), known_ids)
+
+
+async def _allm_section_ids(
+    structured_bill: str,
+    llm: Optional[ChatOpenAI],
+    known_ids: Optional[FrozenSet[str]],
+) -> List[str]:
+    """Extract section IDs with the LLM asynchronously."""
+    chain, parser = _build_id_chain(llm)
+    response = await chain.ainvoke({"bill": structured_bill})
+    return _validate_ids(_parse_ids(parser, response.content), known_ids)
+
+
+def _validate_ids(
+    ids: List[str], known_ids: Optional[FrozenSet[str]]
+) -> List[str]:
+    """Drop blank IDs and, when known, IDs that were never ingested."""
+    ids = [id_val.strip() for id_val in ids if id_val.strip()]
+    if known_ids is not None:
+        ids = [id_val for id_val in ids if id_val in known_ids]
+    return ids
+
+
+def _use_llm_fallback(ids: List[str]) -> bool:
+    """Return whether the LLM extractor should run after the regex one."""
+    return not ids and configs["SECTION_ID_LLM_FALLBACK"].lower() == "true"
+
+
+def get_list(
+    raw_bill: str, llm: Optional[ChatOpenAI] = None
+) -> Tuple[str, List[str]]:
+    """Extract section IDs and retrieve relevant context.
+
+    Section IDs are extracted from the citations in the raw bill and
+    validated against the ingested IDs. The LLM extractor only runs when
+    SECTION_ID_LLM_FALLBACK is set and no citation was found. With
+    RERANK set, the context is reranked against the structured bill.
+
+    Args:
+        raw_bill: Bill text
+        llm: Optional language model
+
+    Returns:
+        Tuple of structured bill and context list
+    """
+    known_ids = ingested_ids()
+    ids = extract_section_ids(raw_bill, known_ids)
+    structured_bill = get_struct_bill(raw_bill, llm)
+    if _use_llm_fallback(ids):
+        ids = _llm_section_ids(structured_bill, llm, known_ids)
+    logger.info(f"Extracted {len(ids)} section IDs: {ids}")
 
-    for id_val in ids:
-        filter_expr = f'id like "{id_val}%"'
-        results = vector_store.similarity_search(id_val, k=3, expr=filter_expr)
-        context.extend(result.page_content for result in results)
+    scored_documents = [
+        pair
+        for results in lookup_section_ids(ids).values()
+        for pair in results
+    ]
 
+    return structured_bill, build_reranked_context(
+        structured_bill, scored_documents
+    )
+
+
+async def _asearch_ids(ids: List[str]) -> List[Tuple[Document, float]]:
+    """Fetch the context of every section ID off the event loop."""
+    searches = await asyncio.to_thread(lookup_section_ids, ids)
+    return [pair for results in searches.values() for pair in results]
+
+
+async def aget_list(
+    raw_bill: str, llm: Optional[ChatOpenAI] = None
+) -> Tuple[str, List[str]]:
+    """Extract section IDs and retrieve relevant context asynchronously.
+
+    The section lookup runs alongside the structuring of the bill unless
+    the LLM extractor is needed.
+
+    Args:
+        raw_bill: Bill text
+        llm: Optional language model
+
+    Returns:
+        Tuple of structured bill and context list
+    """
+    known_ids = ingested_ids()
+    ids = extract_section_ids(raw_bill, known_ids)
+    if _use_llm_fallback(ids):
+        structured_bill = await aget_struct_bill(raw_bill, llm)
+        ids = await _allm_section_ids(structured_bill, llm, known_ids)
+        scored_documents = await _asearch_ids(ids)
+    else:
+        structured_bill, scored_documents = await asyncio.gather(
+            aget_struct_bill(raw_bill, llm), _asearch_ids(ids)
+        )
+    logger.info(f"Extracted {len(ids)} section IDs: {ids}")
+
+    context = await asyncio.to_thread(
+        build_reranked_context, structured_bill, scored_documents
+    )
     return structured_bill, context
 
 
-def get_bill(file_path: Optional[str] = None) -> str:
-    """Load and parse bill from PDF file.
+def parse_bill(file_path: str) -> str:
+    """Parse bill text from a PDF file.
 
     Args:
         file_path: Path to PDF file
@@ -127,3 +419,15 @@ def get_bill(file_path: Optional[str] = None) -> str:
     bill_text_content = "".join(page.page_content for page in pages)
     logger.info(f"Parsed the file successfully: {file_path}")
     return bill_text_content
+
+
+def get_bill(file_path: Optional[str] = None) -> str:
+    """Load bill text from a PDF file, reusing earlier parses of it.
+
+    Args:
+        file_path: Path to PDF file
+
+    Returns:
+        Bill text content
+    """
+    return get_bill_store().get_or_parse(file_path, parse_bill)
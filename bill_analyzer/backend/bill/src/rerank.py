@@ -0,0 +1,131 @@
+# Created by Metrum AI for Dell
+"""Cross-encoder reranking of the context retrieved for a bill."""
+import logging
+import time
+from typing import List, Tuple
+
+from context import build_bill_context, count_tokens
+from langchain_core.documents import Document
+from sentence_transformers import CrossEncoder
+from utils import get_shared_resource, read_config_vars
+
+configs = read_config_vars(
+    {
+        "RERANK": "false",
+        "RERANK_MODEL": "cross-encoder/ms-marco-MiniLM-L-6-v2",
+        "RERANK_THRESHOLD": "0.05",
+        "RERANK_TOP_M": "6",
+    }
+)
+
+# Longest query and passage pair the cross-encoder scores, in tokens.
+RERANK_MAX_LENGTH = 512
+# Words of the bill per query, leaving most of the pair to the passage.
+RERANK_QUERY_WORDS = 128
+
+logger = logging.getLogger(__name__)
+
+
+def create_reranker() -> CrossEncoder:
+    """Load the cross-encoder used to rerank context."""
+    return CrossEncoder(configs["RERANK_MODEL"], max_length=RERANK_MAX_LENGTH)
+
+
+def get_reranker() -> CrossEncoder:
+    """Return the process-wide cross-encoder."""
+    return get_shared_resource("reranker", create_reranker)
+
+
+def rerank_enabled() -> bool:
+    """Return whether retrieved context is reranked."""
+    return configs["RERANK"].lower() == "true"
+
+
+def split_query(query: str) -> List[str]:
+    """Split a long query into chunks the cross-encoder scores whole."""
+    words = query.split()
+    return [
+        " ".join(words[start : start + RERANK_QUERY_WORDS])
+        for start in range(0, len(words), RERANK_QUERY_WORDS)
+    ] or [query]
+
+
+def rerank(
+    query: str, scored_documents: List[Tuple[Document, float]]
+) -> List[Tuple[Document, float]]:
+    """Score documents against a query and keep the relevant ones.
+
+    A structured bill is longer than the cross-encoder's input, so the
+    query is split into chunks and each document keeps its best score
+    against any chunk, instead of truncating both query and document.
+
+    Args:
+        query: Text the documents should be relevant to
+        scored_documents: Retrieved documents with their distance
+
+    Returns:
+        At most RERANK_TOP_M documents scoring at least RERANK_THRESHOLD,
+        paired with one minus their score so that closer sorts first
+    """
+    if not scored_documents:
+        return []
+    documents = [document for document, _ in scored_documents]
+    chunks = split_query(query)
+    pair_scores = get_reranker().predict(
+        [
+            (chunk, document.page_content)
+            for document in documents
+            for chunk in chunks
+        ]
+    )
+    scores = [
+        max(pair_scores[start : start + len(chunks)])
+        for start in range(0, len(pair_scores), len(chunks))
+    ]
+    threshold = float(configs["RERANK_THRESHOLD"])
+    ranked = sorted(
+        (
+            (document, float(score))
+            for document, score in zip(documents, scores)
+            if score >= threshold
+        ),
+        key=lambda pair: pair[1],
+        reverse=True,
+    )
+    return [
+        (document, 1.0 - score)
+        for document, score in ranked[: int(configs["RERANK_TOP_M"])]
+    ]
+
+
+def build_reranked_context(
+    query: str, scored_documents: List[Tuple[Document, float]]
+) -> List[str]:
+    """Build the bill context, reranking it first when RERANK is set.
+
+    The rerank latency is logged with the context tokens it saved, so its
+    CPU cost can be weighed against the prefill it avoids.
+
+    Args:
+        query: Structured bill the context should be relevant to
+        scored_documents: Retrieved documents with their distance
+
+    Returns:
+        Selected passages of the bill context
+    """
+    if not rerank_enabled():
+        return build_bill_context(scored_documents)
+
+    start = time.perf_counter()
+    reranked = rerank(query, scored_documents)
+    seconds = time.perf_counter() - start
+
+    baseline = sum(map(count_tokens, build_bill_context(scored_documents)))
+    context = build_bill_context(reranked)
+    tokens = sum(map(count_tokens, context))
+    logger.info(
+        f"Reranked {len(scored_documents)} passages to {len(reranked)} "
+        f"in {seconds * 1000:.1f}ms: context {baseline} -> {tokens} "
+        f"tokens, {baseline - tokens} saved"
+    )
+    return context
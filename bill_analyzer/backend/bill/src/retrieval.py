@@ -0,0 +1,525 @@
+# Created by Metrum AI for Dell
+"""Retrieval helpers shared by the RAG preprocessing and the agents."""
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from bm25 import BM25Index
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from utils import (
+    get_embeddings,
+    get_milvus_connection,
+    get_shared_resource,
+    read_config_vars,
+)
+from vector_index import EmbeddedVectorStore
+
+COLLECTION_NAME = "HSC"
+PROMPT_CONTEXT_K = 1
+SECTION_CONTEXT_K = 3
+# Concurrent Milvus searches of one batch of section IDs.
+SECTION_SEARCH_WORKERS = 8
+
+configs = read_config_vars(
+    {
+        "INDEX_DIR": "/index",
+        "VECTOR_BACKEND": "milvus",
+        "RETRIEVAL_MODE": "dense",
+        "HYBRID_CANDIDATES": "20",
+        "RRF_K": "60",
+    }
+)
+
+logger = logging.getLogger(__name__)
+
+
+def collection_version() -> str:
+    """Return the version stamp written by the last ingestion run.
+
+    Returns:
+        Version string of the collection, or "unversioned" if ingestion
+        has not written one yet
+    """
+    path = os.path.join(configs["INDEX_DIR"], f"{COLLECTION_NAME}.version")
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return "unversioned"
+
+
+class SectionIndex:
+    """Sorted index of the collection's documents by section ID.
+
+    Ingestion writes the index next to the collection, so context for a
+    known section ID is looked up by key instead of by embedding the ID.
+    """
+
+    def __init__(self, entries: List[Tuple[str, str, dict]]):
+        """Initialize the index.
+
+        Args:
+            entries: (section ID, text, metadata) of every document
+        """
+        entries = sorted(entries, key=lambda entry: entry[0])
+        self.ids = [entry[0] for entry in entries]
+        self.id_set = frozenset(self.ids)
+        self.documents = [
+            Document(page_content=text, metadata=metadata)
+            for _, text, metadata in entries
+        ]
+
+    @classmethod
+    def load(cls, path: str) -> "SectionIndex":
+        """Load an index written by ingestion."""
+        with open(path, "r", encoding="utf-8") as file:
+            return cls([tuple(entry) for entry in json.load(file)])
+
+    def get(self, prefix: str) -> List[Tuple[str, Document]]:
+        """Return the IDs and documents starting with a prefix.
+
+        Matches the 'id like "<prefix>%"' filter of the vector search, so
+        a section's subsections, such as 43013.5 of 43013, are included.
+
+        Args:
+            prefix: Section ID prefix
+
+        Returns:
+            Section ID and document of every match, sorted by ID
+        """
+        start = bisect.bisect_left(self.ids, prefix)
+        # No section ID contains this character, so it ends the range.
+        end = bisect.bisect_left(self.ids, prefix + "\uffff", lo=start)
+        return list(zip(self.ids[start:end], self.documents[start:end]))
+
+
+_SECTION_INDEX: Dict[str, Optional[SectionIndex]] = {}
+
+
+def get_section_index() -> Optional[SectionIndex]:
+    """Return the section index published by the last ingestion run.
+
+    The index is loaded once per collection version.
+
+    Returns:
+        Section index, or None if ingestion has not published one yet
+    """
+    version = collection_version()
+    cached = _SECTION_INDEX.get(version, False)
+    if cached is not False:
+        return cached
+    path = os.path.join(
+        configs["INDEX_DIR"], f"{COLLECTION_NAME}.sections.json"
+    )
+    try:
+        index: Optional[SectionIndex] = SectionIndex.load(path)
+        logger.info(f"Loaded section index of {len(index.ids)} documents")
+    except FileNotFoundError:
+        logger.warning("No section index, searching section IDs in Milvus")
+        index = None
+    # Only the index of the current collection version is kept.
+    _SECTION_INDEX.clear()
+    _SECTION_INDEX[version] = index
+    return index
+
+
+def ingested_ids() -> Optional[FrozenSet[str]]:
+    """Return the section IDs published by the last ingestion run.
+
+    Returns:
+        Set of ingested section IDs, or None if ingestion has not
+        published the section index yet
+    """
+    index = get_section_index()
+    return index.id_set if index is not None else None
+
+
+_EMBEDDED_STORE: Dict[str, EmbeddedVectorStore] = {}
+
+
+def get_embedded_store() -> EmbeddedVectorStore:
+    """Return the embedded vector index published by the last ingestion run.
+
+    The index is memory-mapped once per collection version.
+
+    Raises:
+        RuntimeError: If ingestion has not published the index yet
+    """
+    version = collection_version()
+    store = _EMBEDDED_STORE.get(version)
+    if store is not None:
+        return store
+    index = get_section_index()
+    path = os.path.join(configs["INDEX_DIR"], f"{COLLECTION_NAME}.vectors.npy")
+    if index is None or not os.path.exists(path):
+        raise RuntimeError(
+            "No embedded vector index, run ingestion or set "
+            "VECTOR_BACKEND=milvus"
+        )
+    store = EmbeddedVectorStore.load(
+        get_embeddings(), index.ids, index.documents, path
+    )
+    logger.info(f"Loaded embedded vector index of {len(index.ids)} documents")
+    # Only the index of the current collection version is kept.
+    _EMBEDDED_STORE.clear()
+    _EMBEDDED_STORE[version] = store
+    return store
+
+
+def get_vector_store() -> VectorStore:
+    """Return the vector store of the configured backend.
+
+    VECTOR_BACKEND selects Milvus or the embedded index written by
+    ingestion. Both rank by L2 distance and accept the same ID prefix
+    filter expressions.
+    """
+    if configs["VECTOR_BACKEND"] == "embedded":
+        return get_embedded_store()
+    return get_milvus_connection()
+
+
+_BM25_INDEX: Dict[str, Optional[BM25Index]] = {}
+
+
+def get_bm25_index() -> Optional[BM25Index]:
+    """Return the BM25 index published by the last ingestion run.
+
+    The index is loaded once per collection version.
+
+    Returns:
+        BM25 index, or None if ingestion has not published one yet
+    """
+    version = collection_version()
+    cached = _BM25_INDEX.get(version, False)
+    if cached is not False:
+        return cached
+    path = os.path.join(configs["INDEX_DIR"], f"{COLLECTION_NAME}.bm25.json")
+    try:
+        index: Optional[BM25Index] = BM25Index.load(path)
+        logger.info(f"Loaded BM25 index of {len(index.lengths)} documents")
+    except FileNotFoundError:
+        logger.warning("No BM25 index, using dense retrieval only")
+        index = None
+    # Only the index of the current collection version is kept.
+    _BM25_INDEX.clear()
+    _BM25_INDEX[version] = index
+    return index
+
+
+def reciprocal_rank_fusion(
+    rankings: Iterable[List[Document]], k: int
+) -> List[Document]:
+    """Fuse rankings of documents by reciprocal rank.
+
+    Args:
+        rankings: Documents of each retriever, best first
+        k: Number of documents to return
+
+    Returns:
+        Best documents of the fused ranking. Ties keep the order of
+        first appearance.
+    """
+    rrf_k = int(configs["RRF_K"])
+    scores: Dict[Tuple[str, str], float] = {}
+    documents: Dict[Tuple[str, str], Document] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking):
+            key = (str(document.metadata.get("id")), document.page_content)
+            documents.setdefault(key, document)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+    order = sorted(scores, key=lambda key: scores[key], reverse=True)
+    return [documents[key] for key in order[:k]]
+
+
+def hybrid_search(query: str, k: int = PROMPT_CONTEXT_K) -> List[Document]:
+    """Retrieve documents by fusing dense and BM25 rankings.
+
+    Falls back to dense retrieval when ingestion has not published the
+    BM25 and section indexes.
+
+    Args:
+        query: Query text
+        k: Number of documents
+
+    Returns:
+        List of retrieved documents, best first
+    """
+    lexical_index = get_bm25_index()
+    section_index = get_section_index()
+    if lexical_index is None or section_index is None:
+        return get_vector_store().similarity_search(query, k=k)
+
+    candidates = int(configs["HYBRID_CANDIDATES"])
+    start = time.perf_counter()
+    dense = get_vector_store().similarity_search(query, k=candidates)
+    dense_end = time.perf_counter()
+    lexical = [
+        section_index.documents[row]
+        for row, _ in lexical_index.search(query, candidates)
+    ]
+    lexical_end = time.perf_counter()
+    documents = reciprocal_rank_fusion([dense, lexical], k)
+    logger.info(
+        f"Hybrid search in {(time.perf_counter() - start) * 1000:.2f}ms: "
+        f"dense {(dense_end - start) * 1000:.2f}ms, "
+        f"BM25 {(lexical_end - dense_end) * 1000:.2f}ms"
+    )
+    return documents
+
+
+async def ahybrid_search(
+    query: str, k: int = PROMPT_CONTEXT_K
+) -> List[Document]:
+    """Retrieve documents by fusing dense and BM25 rankings."""
+    return await asyncio.to_thread(hybrid_search, query, k)
+
+
+class RetrievalCache:
+    """In-memory cache of retrieved documents.
+
+    Entries are keyed by the hash of the query and the collection version,
+    and the whole cache is dropped as soon as ingestion publishes a new
+    version of the collection.
+    """
+
+    def __init__(self):
+        """Initialize an empty cache."""
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self._entries: Dict[str, List[Document]] = {}
+
+    def _lookup(self, key: str) -> Tuple[str, Optional[List[Document]]]:
+        """Return the current collection version and the cached entry."""
+        version = collection_version()
+        with self._lock:
+            if version != self._version:
+                if self._entries:
+                    logger.info(
+                        "Collection version changed to %s, "
+                        "dropping %d cached retrievals",
+                        version,
+                        len(self._entries),
+                    )
+                self._entries.clear()
+                self._version = version
+            return version, self._entries.get(key)
+
+    def _store(
+        self, version: str, key: str, documents: List[Document]
+    ) -> None:
+        """Cache an entry unless the collection changed meanwhile."""
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = documents
+
+    @staticmethod
+    def _key(query: str) -> str:
+        """Return the cache key of a query."""
+        return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+    def get(
+        self, query: str, retrieve: Callable[[str], List[Document]]
+    ) -> List[Document]:
+        """Return the documents for a query, retrieving them on a miss.
+
+        Args:
+            query: Query text
+            retrieve: Callable that runs the actual retrieval
+
+        Returns:
+            List of retrieved documents
+        """
+        key = self._key(query)
+        version, documents = self._lookup(key)
+        if documents is None:
+            documents = retrieve(query)
+            self._store(version, key, documents)
+        return documents
+
+    async def aget(
+        self,
+        query: str,
+        retrieve: Callable[[str], Awaitable[List[Document]]],
+    ) -> List[Document]:
+        """Return the documents for a query, retrieving them on a miss.
+
+        Args:
+            query: Query text
+            retrieve: Coroutine function that runs the actual retrieval
+
+        Returns:
+            List of retrieved documents
+        """
+        key = self._key(query)
+        version, documents = self._lookup(key)
+        if documents is None:
+            documents = await retrieve(query)
+            self._store(version, key, documents)
+        return documents
+
+
+def get_retrieval_cache() -> RetrievalCache:
+    """Return the process-wide retrieval cache."""
+    return get_shared_resource("retrieval_cache", RetrievalCache)
+
+
+def _get_prompt_retriever():
+    """Return the retriever used for the constant agent prompts."""
+    return get_vector_store().as_retriever(
+        search_type="similarity", search_kwargs={"k": PROMPT_CONTEXT_K}
+    )
+
+
+def get_prompt_context(prompt: str) -> List[Document]:
+    """Retrieve the documents most relevant to a constant agent prompt.
+
+    RETRIEVAL_MODE selects dense retrieval or the hybrid search.
+
+    Args:
+        prompt: Prompt text to retrieve context for
+
+    Returns:
+        List of retrieved documents
+    """
+    if configs["RETRIEVAL_MODE"] == "hybrid":
+        return get_retrieval_cache().get(prompt, hybrid_search)
+    retriever = _get_prompt_retriever()
+    return get_retrieval_cache().get(prompt, retriever.invoke)
+
+
+async def aget_prompt_context(prompt: str) -> List[Document]:
+    """Retrieve the documents most relevant to a constant agent prompt.
+
+    RETRIEVAL_MODE selects dense retrieval or the hybrid search.
+
+    Args:
+        prompt: Prompt text to retrieve context for
+
+    Returns:
+        List of retrieved documents
+    """
+    if configs["RETRIEVAL_MODE"] == "hybrid":
+        return await get_retrieval_cache().aget(prompt, ahybrid_search)
+    retriever = _get_prompt_retriever()
+    return await get_retrieval_cache().aget(prompt, retriever.ainvoke)
+
+
+def warm_prompt_context(prompts: Iterable[str]) -> None:
+    """Precompute the retrieval cache for a set of constant prompts.
+
+    Args:
+        prompts: Prompts to retrieve context for
+    """
+    for prompt in prompts:
+        get_prompt_context(prompt)
+
+
+def _section_expr(section_id: str) -> str:
+    """Return the filter expression matching a section ID's documents."""
+    return f'id like "{section_id}%"'
+
+
+def search_section_ids_serial(
+    ids: List[str], k: int = SECTION_CONTEXT_K
+) -> Dict[str, List[Tuple[Document, float]]]:
+    """Search the documents of each section ID with one query per ID.
+
+    Args:
+        ids: Section IDs to search
+        k: Number of documents per ID
+
+    Returns:
+        Documents and their distance to the ID, keyed by ID
+    """
+    vector_store = get_vector_store()
+    return {
+        section_id: vector_store.similarity_search_with_score(
+            section_id, k=k, expr=_section_expr(section_id)
+        )
+        for section_id in ids
+    }
+
+
+def search_section_ids(
+    ids: List[str], k: int = SECTION_CONTEXT_K
+) -> Dict[str, List[Tuple[Document, float]]]:
+    """Search the documents of many section IDs concurrently.
+
+    All IDs are embedded in one batch, then each ID runs its own filtered
+    search by vector, so the result matches one search per ID. Milvus
+    searches run in parallel threads, while the embedded index searches
+    each ID's row range of the memory-mapped matrix.
+
+    Args:
+        ids: Section IDs to search
+        k: Number of documents per ID
+
+    Returns:
+        Documents and their distance to the ID, keyed by ID
+    """
+    if not ids:
+        return {}
+    vector_store = get_vector_store()
+    vectors = get_embeddings().embed_documents(list(ids))
+    if isinstance(vector_store, EmbeddedVectorStore):
+        return dict(zip(ids, vector_store.search_vectors(vectors, k, ids)))
+
+    def search(section_id: str, vector: List[float]):
+        """Run the filtered search of one section ID."""
+        return vector_store.similarity_search_with_score_by_vector(
+            vector, k=k, expr=_section_expr(section_id)
+        )
+
+    workers = min(len(ids), SECTION_SEARCH_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(ids, executor.map(search, ids, vectors)))
+
+
+def lookup_section_ids(
+    ids: List[str], k: int = SECTION_CONTEXT_K
+) -> Dict[str, List[Tuple[Document, float]]]:
+    """Fetch the documents of section IDs by key, without embedding.
+
+    Uses the section index when ingestion published one, and the batched
+    vector search otherwise. Like the vector search, an ID also matches
+    the sections it prefixes. Each document is scored by how many
+    characters its ID adds to the cited one, so the cited section itself
+    scores 0 and ranks before its subsections, shallowest first.
+
+    Args:
+        ids: Section IDs to fetch
+        k: Maximum number of documents per ID
+
+    Returns:
+        Documents and their score, lower being closer, keyed by ID
+    """
+    index = get_section_index()
+    if index is None:
+        return search_section_ids(ids, k)
+    results = {}
+    for section_id in ids:
+        scored = [
+            (document, float(len(match) - len(section_id)))
+            for match, document in index.get(section_id)
+        ]
+        # Stable, so matches of the same depth stay in ID order.
+        scored.sort(key=lambda pair: pair[1])
+        results[section_id] = scored[:k]
+    return results
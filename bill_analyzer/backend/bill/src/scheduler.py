@@ -0,0 +1,56 @@
+# Created by Metrum AI for Dell
+"""Bounded submission of tasks that refills a slot on every completion."""
+import threading
+from typing import Any, Callable, List, Optional
+
+
+def run_bounded(
+    submit: Callable[[Any], Any],
+    items: List[Any],
+    limit: Callable[[], int],
+    tick: Optional[float] = None,
+) -> List[Any]:
+    """Submit tasks for items while keeping the number in flight bounded.
+
+    The next item is submitted as soon as any task finishes, whatever the
+    order the tasks were submitted in. The limit is read again after
+    every completion and, with a tick, every tick seconds while none
+    completes, so it can change during the run.
+
+    Args:
+        submit: Callable that submits the task of one item and returns its
+            future, which must support add_done_callback and result
+        items: Items to run, in submission order
+        limit: Callable returning the number of tasks allowed in flight
+        tick: Optional seconds between two reads of the limit
+
+    Returns:
+        List of task results, in completion order
+    """
+    queue = list(items)
+    in_flight = []
+    results = []
+    finished = []
+    lock = threading.Lock()
+    completed = threading.Event()
+
+    def on_done(future: Any) -> None:
+        """Hand a finished future over to the submitting thread."""
+        with lock:
+            finished.append(future)
+            completed.set()
+
+    while queue or in_flight:
+        while queue and len(in_flight) < limit():
+            future = submit(queue.pop(0))
+            in_flight.append(future)
+            future.add_done_callback(on_done)
+        completed.wait(tick)
+        with lock:
+            done = list(finished)
+            finished.clear()
+            completed.clear()
+        for future in done:
+            in_flight.remove(future)
+            results.append(future.result())
+    return results
@@ -1,43 +1,172 @@
 # Created by Metrum AI for Dell
 """Module for serving the bill analysis workflow with parallel processing."""
+import asyncio
+import os
 from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Union
 
-from flow import agent_flow
+from controller import AIMDController
+from flow import agent_flow, agent_flows_async, warm_up
 from metric import get_average_metrics
-from prefect import flow, task
+from prefect import flow, serve, task
 from prefect.futures import wait
 from prefect.logging import get_run_logger
+from prefect.runtime import flow_run
+from prefect_dask import get_dask_client
 from prefect_dask.task_runners import DaskTaskRunner
+from rag import get_bill
+from scheduler import run_bounded
+from usage import count_tokens
+from utils import read_config_vars
+
+configs = read_config_vars(
+    {
+        "BATCH_CONCURRENCY": "8",
+    }
+)
+
+
+@task(name="Warm Up")
+def warm_up_workers() -> int:
+    """Build the shared resources on every Dask worker process.
+
+    Returns:
+        Number of Dask workers
+    """
+    with get_dask_client() as client:
+        return len(client.run(warm_up))
 
 
 @task(name="Agent Analysis")
-def agent_call(bill: str, replica: int) -> str:
+def agent_call(bill: str, replica: int, use_async: bool = False) -> str:
     """Run agent analysis workflow for a single replica.
 
     Args:
         bill: Path to bill file
         replica: Replica number for parallel run
+        use_async: Whether to run the asyncio-native workflow
 
     Returns:
         Analysis report string
     """
+    if use_async:
+        return asyncio.run(agent_flows_async(bill, [replica]))[0]
     result = agent_flow(bill, replica)
     return result
 
 
+@task(name="Agent Analysis Group")
+def agent_group_call(bill: str, replicas: List[int]) -> List[str]:
+    """Run a group of replicas on one event loop of a Dask worker.
+
+    Args:
+        bill: Path to bill file
+        replicas: Replica numbers to run
+
+    Returns:
+        Analysis report strings, in the order of the replicas
+    """
+    return asyncio.run(agent_flows_async(bill, replicas))
+
+
+@task(name="Bill Analysis")
+def bill_call(
+    bill: str, replica: int, batch: str, use_async: bool = False
+) -> Dict[str, Any]:
+    """Run agent analysis workflow for one bill of a batch.
+
+    Args:
+        bill: Path to bill file
+        replica: Index of the bill in the batch
+        batch: Flow run ID of the batch
+        use_async: Whether to run the asyncio-native workflow
+
+    Returns:
+        Dictionary with the bill path, report, run window and the tokens
+        generated for the bill
+    """
+    start_time = datetime.now()
+    with count_tokens() as usage:
+        if use_async:
+            result = asyncio.run(agent_flows_async(bill, [replica], batch))[0]
+        else:
+            result = agent_flow(bill, replica, batch)
+    return {
+        "bill": bill,
+        "report": result,
+        "start": start_time,
+        "end": datetime.now(),
+        "prompt_tokens": usage.prompt_tokens,
+        "output_tokens": usage.output_tokens,
+    }
+
+
+def list_bills(bills: Union[str, List[str]]) -> List[str]:
+    """Expand a directory or list of paths into the bill files to analyze.
+
+    Args:
+        bills: Directory of PDF bills, single bill path, or list of paths
+
+    Returns:
+        Sorted list of bill file paths
+    """
+    if isinstance(bills, str):
+        if not os.path.isdir(bills):
+            return [bills]
+        return sorted(
+            os.path.join(bills, name)
+            for name in os.listdir(bills)
+            if name.lower().endswith(".pdf")
+        )
+    return list(bills)
+
+
 @flow(task_runner=DaskTaskRunner)
-def start(bill: str, replicas: int) -> None:
+def start(
+    bill: str, replicas: int, use_async: bool = False, adaptive: bool = False
+) -> None:
     """Start parallel bill analysis workflow.
 
     Args:
         bill: Path to bill file
         replicas: Number of parallel replicas to run
+        use_async: Whether replicas run the asyncio-native workflow.
+            Without adaptive, the replicas are split into one group per
+            Dask worker, and each group runs on a single event loop.
+        adaptive: Whether an AIMD controller decides how many of the
+            replicas are in flight, instead of running all at once
     """
+    workers = warm_up_workers.submit().result()
+    # Parse once up front so every replica hits the shared bill cache.
+    get_bill(bill)
     start_time = datetime.now() + timedelta(0, 30)
-    results = []
-    for replica in range(replicas):
-        results.append(agent_call.submit(bill, replica + 1))
-    wait(results)
+    if adaptive:
+        controller = AIMDController(
+            int(configs["BATCH_CONCURRENCY"]),
+            maximum=replicas,
+            log=get_run_logger(),
+        )
+        run_bounded(
+            lambda replica: agent_call.submit(bill, replica, use_async),
+            list(range(1, replicas + 1)),
+            controller.update,
+            tick=controller.interval,
+        )
+    elif use_async:
+        numbers = list(range(1, replicas + 1))
+        groups = [numbers[offset::workers] for offset in range(workers)]
+        wait(
+            [
+                agent_group_call.submit(bill, group)
+                for group in groups
+                if group
+            ]
+        )
+    else:
+        results = []
+        for replica in range(replicas):
+            results.append(agent_call.submit(bill, replica + 1, use_async))
+        wait(results)
     end_time = datetime.now() - timedelta(0, 10)
     res = get_average_metrics(start_time, end_time)
     logger = get_run_logger()
@@ -45,5 +174,75 @@ def start(bill: str, replicas: int) -> None:
     logger.info(out)
 
 
+@flow(name="start_batch", task_runner=DaskTaskRunner)
+def start_batch(
+    bills: Union[str, List[str]],
+    max_concurrency: Optional[int] = None,
+    use_async: bool = False,
+    adaptive: bool = False,
+) -> None:
+    """Analyze a queue of different bills with bounded concurrency.
+
+    At most max_concurrency bills are in flight at a time, and the next
+    bill is submitted as soon as one finishes, so the vLLM backends stay
+    saturated without being overloaded. The throughput of each bill is
+    its own generated tokens over its duration, as bills overlap.
+
+    Args:
+        bills: Directory of PDF bills or list of bill paths
+        max_concurrency: Maximum number of bills in flight, defaults to
+            BATCH_CONCURRENCY
+        use_async: Whether bills run the asyncio-native workflow
+        adaptive: Whether an AIMD controller adjusts the number of bills
+            in flight from live vLLM metrics, starting at max_concurrency
+    """
+    logger = get_run_logger()
+    max_concurrency = max_concurrency or int(configs["BATCH_CONCURRENCY"])
+    queue = list(enumerate(list_bills(bills), start=1))
+    if not queue:
+        raise ValueError(f"No bills found in {bills}")
+    controller = (
+        AIMDController(max_concurrency, log=logger) if adaptive else None
+    )
+    warm_up_workers.submit().wait()
+
+    # Artifacts of the batch's bills are namespaced by its flow run.
+    batch = str(flow_run.id)
+    start_time = datetime.now()
+    results = run_bounded(
+        lambda item: bill_call.submit(item[1], item[0], batch, use_async),
+        queue,
+        controller.update if controller else lambda: max_concurrency,
+        tick=controller.interval if controller else None,
+    )
+    end_time = datetime.now()
+
+    for result in results:
+        seconds = (result["end"] - result["start"]).total_seconds()
+        logger.info(
+            f"Bill {result['bill']} completed in {seconds:.1f}s. "
+            f"Generated {result['output_tokens']} tokens for "
+            f"{result['prompt_tokens']} prompt tokens. Throughput: "
+            f"{result['output_tokens'] / seconds:.1f} tokens/s"
+        )
+
+    res = get_average_metrics(start_time, end_time)
+    seconds = (end_time - start_time).total_seconds()
+    output_tokens = sum(result["output_tokens"] for result in results)
+    out = (
+        f"Batch of {len(results)} bills completed in {seconds:.1f}s "
+        f"({len(results) / seconds * 60:.2f} bills/min). "
+        f"Generated {output_tokens} tokens "
+        f"({output_tokens / seconds:.1f} tokens/s). "
+        f"Throughput: {res['throughput']}, CPU Utilization: {res['util']}, "
+        f"CPU Power in Watts: {res['power']}"
+    )
+    logger.info(out)
+
+
 if __name__ == "__main__":
-    start.serve(name="agent_run")
+    warm_up()
+    serve(
+        start.to_deployment(name="agent_run"),
+        start_batch.to_deployment(name="agent_batch_run"),
+    )
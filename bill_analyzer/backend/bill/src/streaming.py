@@ -0,0 +1,189 @@
+# Created by Metrum AI for Dell
+"""Publishing of streamed LLM tokens and per-step generation statistics."""
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+import redis
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from utils import get_valkey_client, read_config_vars
+
+configs = read_config_vars(
+    {
+        "STREAM_TOKENS": "true",
+        "STREAM_TTL": "86400",
+    }
+)
+
+logger = logging.getLogger(__name__)
+
+
+def stream_name(key: str) -> str:
+    """Return the valkey stream that carries the tokens of an output key.
+
+    Args:
+        key: Output key of a flow run (e.g. "<flow run ID>:legal")
+
+    Returns:
+        Name of the valkey stream
+    """
+    return f"stream:{key}"
+
+
+class TokenStreamPublisher(BaseCallbackHandler):
+    """Callback handler that publishes streamed tokens to valkey.
+
+    Every LLM call made under the handler publishes its tokens, tagged with
+    the graph step that made the call, to the stream of one output key.
+    The time to first token and the generation rate of each call are logged
+    and published with the call's end event. The rate is in tokens/s when
+    the server reports token usage, and in streamed chunks/s otherwise.
+    """
+
+    def __init__(self, key: str, client: Optional[redis.Redis] = None):
+        """Initialize the publisher and reset the output key's stream.
+
+        Output keys are unique to a flow run, so only a retry of the same
+        run resets a stream that already has events.
+
+        Args:
+            key: Output key of a flow run (e.g. "<flow run ID>:legal")
+            client: Optional valkey client
+        """
+        self.key = key
+        self.stream = stream_name(key)
+        self.client = client if client else get_valkey_client()
+        self._lock = threading.Lock()
+        self._calls: Dict[UUID, Dict[str, Any]] = {}
+        self.client.delete(self.stream)
+        self._publish({"event": "start"})
+
+    def _publish(self, fields: Dict[str, Any]) -> None:
+        """Append an event to the stream, never failing the LLM call."""
+        try:
+            pipeline = self.client.pipeline()
+            pipeline.xadd(self.stream, {"data": json.dumps(fields)})
+            pipeline.expire(self.stream, int(configs["STREAM_TTL"]))
+            pipeline.execute()
+        except redis.RedisError as error:
+            logger.warning(f"Failed to publish to {self.stream}: {error}")
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List[Any]],
+        *,
+        run_id: UUID,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Record the start of an LLM call."""
+        step = (metadata or {}).get("langgraph_node", self.key)
+        with self._lock:
+            self._calls[run_id] = {
+                "step": step,
+                "start": time.perf_counter(),
+                "first_token": None,
+                "chunks": 0,
+            }
+
+    def on_llm_new_token(
+        self, token: str, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        """Publish a streamed token."""
+        with self._lock:
+            call = self._calls.get(run_id)
+            if call is None:
+                return
+            if call["first_token"] is None:
+                call["first_token"] = time.perf_counter()
+            call["chunks"] += 1
+        self._publish({"event": "token", "step": call["step"], "token": token})
+
+    def on_llm_end(
+        self, response: LLMResult, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        """Publish the statistics of a finished LLM call."""
+        with self._lock:
+            call = self._calls.pop(run_id, None)
+        if call is None:
+            return
+        end = time.perf_counter()
+        generation = response.generations[0][0]
+        usage = getattr(
+            getattr(generation, "message", None), "usage_metadata", None
+        )
+        stats = {
+            "event": "end",
+            "step": call["step"],
+            "chunks": call["chunks"],
+        }
+        if usage:
+            stats["tokens"] = usage["output_tokens"]
+        if call["first_token"] is None:
+            # Served from the response cache, nothing was streamed.
+            stats["token"] = generation.text
+            stats["cached"] = True
+        else:
+            generation_time = end - call["first_token"]
+            stats["ttft"] = round(call["first_token"] - call["start"], 4)
+            # Chunks usually, but not always, carry one token each.
+            rate_key, count = (
+                ("tokens_per_s", stats["tokens"])
+                if usage
+                else ("chunks_per_s", call["chunks"])
+            )
+            stats[rate_key] = round(
+                count / generation_time if generation_time else 0.0, 2
+            )
+        stats["latency"] = round(end - call["start"], 4)
+        logger.info(f"{self.key} step {call['step']}: {stats}")
+        self._publish(stats)
+
+    def on_llm_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        """Drop the bookkeeping of a failed LLM call."""
+        with self._lock:
+            self._calls.pop(run_id, None)
+
+    def close(self, output: str) -> None:
+        """Publish the final output and mark the stream as done.
+
+        Args:
+            output: Final output of the agent
+        """
+        self._publish({"event": "done", "output": output})
+
+
+def stream_callbacks(key: Optional[str]) -> List[TokenStreamPublisher]:
+    """Return the callbacks that stream an output key, if enabled.
+
+    Args:
+        key: Output key of a flow run (e.g. "<flow run ID>:legal")
+
+    Returns:
+        List with the publisher, or an empty list when streaming is off
+    """
+    if not key or configs["STREAM_TOKENS"].lower() != "true":
+        return []
+    try:
+        return [TokenStreamPublisher(key)]
+    except redis.RedisError as error:
+        logger.warning(f"Token streaming disabled for {key}: {error}")
+        return []
+
+
+def close_streams(callbacks: List[TokenStreamPublisher], output: str) -> None:
+    """Publish the final output to every stream of a run.
+
+    Args:
+        callbacks: Callbacks returned by stream_callbacks
+        output: Final output of the run
+    """
+    for callback in callbacks:
+        callback.close(output)
@@ -0,0 +1,72 @@
+# Created by Metrum AI for Dell
+"""Counting of the tokens generated for one unit of work, such as a bill."""
+import contextvars
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+
+class TokenUsage:
+    """Prompt and output tokens of the LLM calls made under count_tokens."""
+
+    def __init__(self):
+        """Initialize the counters."""
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def add(self, prompt_tokens: int, output_tokens: int) -> None:
+        """Add the usage of one LLM call."""
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.output_tokens += output_tokens
+            self.calls += 1
+
+
+# Usage of the work the current context belongs to. Prefect task threads
+# and asyncio tasks copy the context, so they all add to the same object.
+_CURRENT_USAGE: contextvars.ContextVar[Optional[TokenUsage]] = (
+    contextvars.ContextVar("token_usage", default=None)
+)
+
+
+@contextmanager
+def count_tokens() -> Iterator[TokenUsage]:
+    """Count the tokens of every LLM call made in the current context."""
+    usage = TokenUsage()
+    token = _CURRENT_USAGE.set(usage)
+    try:
+        yield usage
+    finally:
+        _CURRENT_USAGE.reset(token)
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """Callback handler adding the reported token usage to count_tokens."""
+
+    # Run in the context of the LLM call, not in an executor.
+    run_inline = True
+
+    def on_llm_end(
+        self, response: LLMResult, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        """Add the token usage of a finished LLM call."""
+        usage = _CURRENT_USAGE.get()
+        if usage is None:
+            return
+        for generations in response.generations:
+            for generation in generations:
+                metadata = getattr(
+                    getattr(generation, "message", None),
+                    "usage_metadata",
+                    None,
+                )
+                if metadata:
+                    usage.add(
+                        metadata["input_tokens"], metadata["output_tokens"]
+                    )
@@ -1,21 +1,45 @@
 # Created by Metrum AI for Dell
 """"Utility methods for the auth module"""
 
+import asyncio
 import logging
 import os
+import sqlite3
+import threading
 import time
-from typing import Optional
+import weakref
+from typing import Any, Callable, Dict, Optional
 
+import redis
 import requests
-from langchain.chat_models import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
+from cache import (
+    DiskResponseStore,
+    LLMResponseCache,
+    ValkeyResponseStore,
+)
+from embedding_cache import CachedEmbeddings, SQLiteEmbeddingStore
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_milvus import Milvus
+from langchain_openai import ChatOpenAI
+from openai import DefaultAsyncHttpxClient
+from prompts import build_prompt
 from requests.exceptions import RequestException
+from usage import TokenUsageCallback
+
+ANSWER_LIMIT = "Answer the User query in under 200 words."
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Process-wide registry of expensive, reusable resources. Every Dask worker
+# process builds each resource once and shares it across tasks and replicas.
+_SHARED_RESOURCES: Dict[str, Any] = {}
+_SHARED_RESOURCES_LOCK = threading.Lock()
+
+# ChatOpenAI clients of the running event loops. An async HTTP client is
+# bound to the loop it first ran on, so every loop gets its own.
+_LOOP_LLM_MODELS: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
 
 def read_config_vars(
     default_configs: dict[str, str],
@@ -27,30 +51,86 @@ def read_config_vars(
     return default_configs
 
 
-def create_milvus_connection(
-    max_retries: int = 5, retry_delay: int = 5
-) -> Optional[Milvus]:
-    """Create Milvus connection with retry logic."""
+def get_shared_resource(name: str, factory: Callable[[], Any]) -> Any:
+    """Return the process-wide instance of a resource, building it once.
 
+    Args:
+        name: Registry key of the resource
+        factory: Callable that builds the resource on first use
+
+    Returns:
+        The shared resource instance
+    """
+    if name in _SHARED_RESOURCES:
+        return _SHARED_RESOURCES[name]
+    with _SHARED_RESOURCES_LOCK:
+        if name not in _SHARED_RESOURCES:
+            logger.info(f"Initializing shared resource: {name}")
+            _SHARED_RESOURCES[name] = factory()
+        return _SHARED_RESOURCES[name]
+
+
+def reset_shared_resources(*names: str) -> None:
+    """Drop shared resources so they are rebuilt on next use.
+
+    Args:
+        names: Registry keys to drop. Drops every resource if none are given.
+    """
+    with _SHARED_RESOURCES_LOCK:
+        for name in names or list(_SHARED_RESOURCES):
+            _SHARED_RESOURCES.pop(name, None)
+
+
+def create_embeddings() -> CachedEmbeddings:
+    """Create the cached embedding model used for retrieval."""
     configs = read_config_vars(
         {
-            "MILVUS_URI": "http://milvus:19530",
             "EMBEDDING_MODEL": "BAAI/bge-small-en-v1.5",
+            "EMBEDDING_CACHE_SIZE": "10000",
+            "EMBEDDING_CACHE_PATH": "/index/embeddings.sqlite",
+            "EMBEDDING_BATCH_WINDOW_MS": "5",
         }
     )
 
     try:
-        EMBEDDINGS = HuggingFaceEmbeddings(
-            model_name=configs["EMBEDDING_MODEL"]
+        store = (
+            SQLiteEmbeddingStore(configs["EMBEDDING_CACHE_PATH"])
+            if configs["EMBEDDING_CACHE_PATH"]
+            else None
+        )
+        return CachedEmbeddings(
+            HuggingFaceEmbeddings(model_name=configs["EMBEDDING_MODEL"]),
+            model_name=configs["EMBEDDING_MODEL"],
+            max_size=int(configs["EMBEDDING_CACHE_SIZE"]),
+            store=store,
+            batch_window=float(configs["EMBEDDING_BATCH_WINDOW_MS"]) / 1000,
         )
-        MILVUS_URI = configs["MILVUS_URI"]
     except KeyError as error:
         logger.error(f"Missing required configuration: {str(error)}")
         raise
-    except (ValueError, OSError) as error:
+    except (ValueError, OSError, sqlite3.Error) as error:
         logger.error(f"Error initializing embeddings: {str(error)}")
         raise
 
+
+def get_embeddings() -> CachedEmbeddings:
+    """Return the process-wide embedding model."""
+    return get_shared_resource("embeddings", create_embeddings)
+
+
+def create_milvus_connection(
+    max_retries: int = 5, retry_delay: int = 5
+) -> Optional[Milvus]:
+    """Create Milvus connection with retry logic."""
+
+    configs = read_config_vars(
+        {
+            "MILVUS_URI": "http://milvus:19530",
+        }
+    )
+    EMBEDDINGS = get_embeddings()
+    MILVUS_URI = configs["MILVUS_URI"]
+
     for attempt in range(max_retries):
         try:
             vector_store = Milvus(
@@ -72,34 +152,95 @@ def create_milvus_connection(
                 )
 
 
-def create_analysis_chain(model, prompt_template):
+def get_milvus_connection() -> Milvus:
+    """Return the process-wide Milvus vector store handle."""
+    return get_shared_resource("milvus", create_milvus_connection)
+
+
+def create_analysis_chain(model, prompt_template, sections=()):
     """Create a chain for analysis with standard system message.
 
+    The prompt starts with the prefix shared by every call for the bill,
+    so only the sections and the step instruction are prefilled anew.
+
     Args:
         model: The language model to use
         prompt_template: The specific prompt template for this analysis
+        sections: (title, variable) pairs of step-specific inputs
 
     Returns:
         The configured chain
     """
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            (
-                "system",
-                "You are an Intelligent Assistant who follows instructions properly, "
-                "Answer the User query in under 200 words",
-            ),
-            ("human", prompt_template),
-        ]
-    )
+    prompt = build_prompt(f"{ANSWER_LIMIT}\n{prompt_template}", sections)
     return prompt | model
 
 
-def create_llm_model() -> ChatOpenAI:
+def create_valkey_client() -> redis.Redis:
+    """Create a client for the shared valkey instance."""
+    configs = read_config_vars(
+        {
+            "REDIS_HOST": "redis",
+            "REDIS_PORT": "6379",
+            "REDIS_DB": "0",
+        }
+    )
+    return redis.Redis(
+        host=configs["REDIS_HOST"],
+        port=int(configs["REDIS_PORT"]),
+        db=int(configs["REDIS_DB"]),
+    )
+
+
+def get_valkey_client() -> redis.Redis:
+    """Return the process-wide valkey client."""
+    return get_shared_resource("valkey", create_valkey_client)
+
+
+def create_llm_cache() -> Optional[LLMResponseCache]:
+    """Create the response cache for temperature-0 LLM calls.
+
+    The cache is off by default: throughput is measured by running the
+    same bill several times, and cached answers would inflate it.
+
+    Returns:
+        The configured cache, or None when LLM_CACHE is empty or off
+    """
+    configs = read_config_vars(
+        {
+            "LLM_CACHE": "",
+            "LLM_CACHE_DIR": "/tmp/llm_cache",
+            "LLM_CACHE_SIZE": "10000",
+        }
+    )
+    backend = configs["LLM_CACHE"].lower()
+    max_size = int(configs["LLM_CACHE_SIZE"])
+    if not backend or backend == "off":
+        return None
+    if backend == "disk":
+        return LLMResponseCache(
+            DiskResponseStore(configs["LLM_CACHE_DIR"], max_size)
+        )
+    if backend == "valkey":
+        return LLMResponseCache(
+            ValkeyResponseStore(
+                get_valkey_client(), max_size, prefix="llm-cache:"
+            )
+        )
+    raise ValueError(f"Unsupported LLM_CACHE backend: {backend}")
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """Return the process-wide LLM response cache, if enabled."""
+    return get_shared_resource("llm_cache", create_llm_cache)
+
+
+def create_llm_model(
+    http_async_client: Optional[DefaultAsyncHttpxClient] = None,
+) -> ChatOpenAI:
     """Create and return a ChatOpenAI model instance with standard configuration.
 
     Args:
-        configs: Optional configuration dictionary. If None, will read from environment.
+        http_async_client: Optional async HTTP client of the model
 
     Returns:
         Configured ChatOpenAI model instance
@@ -115,6 +256,7 @@ def create_llm_model() -> ChatOpenAI:
                 "MODEL_NAME": "meta-llama/Llama-3.2-3B-Instruct",
                 "API_KEY": None,
                 "VLLM_URL": "http://nginx-proxy:8100/vllm/v1",
+                "STREAM_TOKENS": "true",
             }
         )
 
@@ -126,6 +268,12 @@ def create_llm_model() -> ChatOpenAI:
             api_key=configs["API_KEY"],
             base_url=configs["VLLM_URL"],
             temperature=0,
+            cache=get_llm_cache() or False,
+            streaming=configs["STREAM_TOKENS"].lower() == "true",
+            # Report token usage in the last chunk, for tokens/s per step.
+            stream_usage=True,
+            callbacks=[TokenUsageCallback()],
+            http_async_client=http_async_client,
         )
 
     except KeyError as error:
@@ -134,3 +282,47 @@ def create_llm_model() -> ChatOpenAI:
         raise ConnectionError(
             f"Failed to connect to LLM service: {str(error)}"
         )
+
+
+def get_llm_model() -> ChatOpenAI:
+    """Return the process-wide ChatOpenAI client."""
+    return get_shared_resource("llm", create_llm_model)
+
+
+def get_async_llm_model() -> ChatOpenAI:
+    """Return the ChatOpenAI client of the running event loop.
+
+    The process-wide client serves sync calls from any thread, but its
+    async HTTP client would be shared across the event loops of several
+    threads. Each loop gets a client of its own instead, to be closed
+    with close_async_llm_model before the loop ends.
+    """
+    loop = asyncio.get_running_loop()
+    with _SHARED_RESOURCES_LOCK:
+        if loop not in _LOOP_LLM_MODELS:
+            _LOOP_LLM_MODELS[loop] = create_llm_model(
+                DefaultAsyncHttpxClient()
+            )
+        return _LOOP_LLM_MODELS[loop]
+
+
+async def close_async_llm_model() -> None:
+    """Close the async HTTP client of the running event loop, if any."""
+    with _SHARED_RESOURCES_LOCK:
+        model = _LOOP_LLM_MODELS.pop(asyncio.get_running_loop(), None)
+    if model is not None:
+        await model.http_async_client.aclose()
+
+
+def warm_up_resources() -> None:
+    """Build the shared resources ahead of the first task.
+
+    Loading the embedding model and connecting to Milvus dominate the cost
+    of the first run in a process, so the service does it at startup.
+    """
+    get_llm_model()
+    configs = read_config_vars({"VECTOR_BACKEND": "milvus"})
+    if configs["VECTOR_BACKEND"] == "milvus":
+        get_milvus_connection()
+    else:
+        get_embeddings()
@@ -0,0 +1,212 @@
+# Created by Metrum AI for Dell
+"""Embedded, in-process vector index of the collection.
+
+Ingestion writes a matrix of normalized embeddings whose rows follow the
+section index, sorted by section ID. The matrix is memory-mapped and
+searched with a vectorized top-k, so retrieval needs no Milvus service.
+"""
+import bisect
+import re
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+# Writes go through ingestion, which publishes the matrix and its index.
+READ_ONLY_MESSAGE = (
+    "The embedded vector index is read-only. Add documents by running "
+    "ingestion, whose LocalIndexWriter publishes the index, and reload it "
+    "with retrieval.get_embedded_store"
+)
+
+# The only filter the agents use, e.g. 'id like "43013%"'.
+PREFIX_EXPR_PATTERN = re.compile(
+    r'^\s*id\s+like\s+"(?P<prefix>[^"%]*)%"\s*$'
+)
+
+
+def parse_prefix_expr(expr: Optional[str]) -> Optional[str]:
+    """Return the section ID prefix of a Milvus filter expression.
+
+    Args:
+        expr: Filter expression, or None for no filter
+
+    Returns:
+        Prefix the section IDs must start with, or None for no filter
+
+    Raises:
+        ValueError: If the expression is not an ID prefix filter
+    """
+    if expr is None:
+        return None
+    match = PREFIX_EXPR_PATTERN.match(expr)
+    if not match:
+        raise ValueError(f"Unsupported filter expression: {expr}")
+    return match.group("prefix")
+
+
+class EmbeddedVectorStore(VectorStore):
+    """Read-only vector store over a memory-mapped embedding matrix.
+
+    The store only serves searches. add_texts and from_texts raise, as
+    the matrix and its section index are published together by
+    ingestion's LocalIndexWriter; load the published matrix with load.
+
+    Distances are squared L2 between normalized vectors, so they rank
+    like the L2 metric of the Milvus collection.
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        ids: Sequence[str],
+        documents: Sequence[Document],
+        vectors: np.ndarray,
+    ):
+        """Initialize the store.
+
+        Args:
+            embedding: Embedding model used for queries
+            ids: Section ID of every row, sorted
+            documents: Document of every row
+            vectors: Normalized embedding of every row
+        """
+        if not len(ids) == len(documents) == len(vectors):
+            raise ValueError(
+                f"Vector index has {len(vectors)} rows "
+                f"for {len(documents)} documents"
+            )
+        self._embedding = embedding
+        self.ids = ids
+        self.documents = documents
+        self.vectors = vectors
+
+    @classmethod
+    def load(
+        cls,
+        embedding: Embeddings,
+        ids: Sequence[str],
+        documents: Sequence[Document],
+        path: str,
+    ) -> "EmbeddedVectorStore":
+        """Memory-map a vector matrix written by ingestion."""
+        return cls(embedding, ids, documents, np.load(path, mmap_mode="r"))
+
+    @property
+    def embeddings(self) -> Embeddings:
+        """Return the embedding model used for queries."""
+        return self._embedding
+
+    def _rows(self, prefix: Optional[str]) -> Tuple[int, int]:
+        """Return the row range of the IDs starting with a prefix."""
+        if not prefix:
+            return 0, len(self.ids)
+        start = bisect.bisect_left(self.ids, prefix)
+        # No section ID contains this character, so it ends the range.
+        end = bisect.bisect_left(self.ids, prefix + "\uffff", lo=start)
+        return start, end
+
+    def search_vectors(
+        self,
+        vectors: Iterable[Sequence[float]],
+        k: int,
+        prefixes: Iterable[Optional[str]],
+    ) -> List[List[Tuple[Document, float]]]:
+        """Return the k closest documents of each query vector.
+
+        Args:
+            vectors: Query embeddings
+            k: Number of documents per query
+            prefixes: Section ID prefix each query is restricted to, or
+                None for the whole collection
+
+        Returns:
+            Documents and their distance to the query, closest first,
+            for each query
+        """
+        results = []
+        for vector, prefix in zip(vectors, prefixes):
+            start, end = self._rows(prefix)
+            if start == end:
+                results.append([])
+                continue
+            query = np.array(vector, dtype=np.float32)
+            query /= np.linalg.norm(query) or 1.0
+            distances = 2.0 - 2.0 * (self.vectors[start:end] @ query)
+            count = min(k, end - start)
+            top = np.argpartition(distances, count - 1)[:count]
+            top = top[np.argsort(distances[top], kind="stable")]
+            results.append(
+                [
+                    (self.documents[start + row], float(distances[row]))
+                    for row in top
+                ]
+            )
+        return results
+
+    def similarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        expr: Optional[str] = None,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        """Return the k documents closest to a query.
+
+        Args:
+            query: Query text
+            k: Number of documents
+            expr: Optional ID prefix filter, as passed to Milvus
+
+        Returns:
+            Documents and their distance to the query, closest first
+        """
+        vector = self._embedding.embed_query(query)
+        return self.search_vectors([vector], k, [parse_prefix_expr(expr)])[0]
+
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        expr: Optional[str] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        """Return the k documents closest to a query."""
+        return [
+            document
+            for document, _ in self.similarity_search_with_score(
+                query, k=k, expr=expr
+            )
+        ]
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        """Reject writes, as the index is published by ingestion.
+
+        Raises:
+            NotImplementedError: Always
+        """
+        raise NotImplementedError(READ_ONLY_MESSAGE)
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any,
+    ) -> "EmbeddedVectorStore":
+        """Reject building an index here, as ingestion publishes it.
+
+        Use EmbeddedVectorStore.load on the published matrix instead.
+
+        Raises:
+            NotImplementedError: Always
+        """
+        raise NotImplementedError(READ_ONLY_MESSAGE)
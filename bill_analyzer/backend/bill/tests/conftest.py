@@ -0,0 +1,12 @@
+# Created by Metrum AI for Dell
+"""Put the bill service and shared sources on the import path.
+
+The image copies both into one directory.
+"""
+import os
+import sys
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+for directory in ("shared", os.path.join("bill", "src")):
+    sys.path.insert(0, os.path.join(BACKEND, directory))
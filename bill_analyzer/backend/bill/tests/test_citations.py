@@ -0,0 +1,17 @@
+# Created by Metrum AI for Dell
+"""Tests of the extraction of section citations from bill text."""
+from citations import extract_section_ids
+
+
+def test_range_is_expanded_to_known_ids():
+    """A cited range returns the ingested IDs it spans, in order."""
+    text = "Sections 100 to 102, inclusive, of the Health and Safety Code"
+    known = {"99", "100", "101.5", "102", "103"}
+    assert extract_section_ids(text, known) == ["100", "101.5", "102"]
+
+
+def test_range_skips_non_numeric_known_ids():
+    """Ingested IDs that are not plain numbers do not break a range."""
+    text = "Sections 100 through 102 of the Health and Safety Code"
+    known = {"100", "101a", "Chapter", "102"}
+    assert extract_section_ids(text, known) == ["100", "102"]
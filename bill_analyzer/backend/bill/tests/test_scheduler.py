@@ -0,0 +1,113 @@
+# Created by Metrum AI for Dell
+"""Tests of the bounded task submission used by the batch flows."""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scheduler import run_bounded
+
+
+def test_slow_item_does_not_hold_back_the_others():
+    """Slots freed by fast items are refilled while a slow one runs."""
+    release = threading.Event()
+    started = []
+
+    def work(item):
+        started.append(item)
+        if item == "slow":
+            release.wait(5)
+        return item
+
+    items = ["slow"] + [f"fast-{number}" for number in range(6)]
+    results = []
+    with ThreadPoolExecutor(max_workers=len(items)) as executor:
+        runner = threading.Thread(
+            target=lambda: results.extend(
+                run_bounded(
+                    lambda item: executor.submit(work, item), items, lambda: 2
+                )
+            )
+        )
+        runner.start()
+        deadline = time.monotonic() + 5
+        while len(started) < len(items) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Every fast item ran through the second slot before the slow one
+        # finished.
+        assert len(started) == len(items)
+        release.set()
+        runner.join(5)
+
+    assert results[-1] == "slow"
+    assert sorted(results[:-1]) == sorted(items[1:])
+
+
+def test_in_flight_tasks_stay_within_the_limit():
+    """No more tasks than the limit run at the same time."""
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def work(item):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return item
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = run_bounded(
+            lambda item: executor.submit(work, item),
+            list(range(20)),
+            lambda: 3,
+        )
+
+    assert sorted(results) == list(range(20))
+    assert peak[0] <= 3
+
+
+def test_limit_is_read_after_every_completion():
+    """A limit raised on a completion takes effect right away."""
+    reads = []
+    finished = []
+
+    def limit():
+        reads.append(len(finished))
+        return 1 if not finished else 4
+
+    def work(item):
+        time.sleep(0.01 if item == 0 else 0.2)
+        finished.append(item)
+        return item
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = run_bounded(
+            lambda item: executor.submit(work, item), list(range(4)), limit
+        )
+
+    assert sorted(results) == list(range(4))
+    # After the first item, the other three run side by side.
+    assert time.monotonic() - start < 0.4
+    assert 1 in reads
+
+
+def test_limit_is_read_every_tick_while_none_completes():
+    """The limit is read on the tick while a long task holds the slot."""
+    reads = []
+
+    def limit():
+        reads.append(time.monotonic())
+        return 1
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        run_bounded(
+            lambda item: executor.submit(time.sleep, item),
+            [0.3, 0.0],
+            limit,
+            tick=0.05,
+        )
+
+    assert len(reads) >= 4
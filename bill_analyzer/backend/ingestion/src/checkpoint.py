@@ -0,0 +1,56 @@
+# Created by Metrum AI for Dell
+"""Checkpoint of the batches committed by an ingestion run."""
+import json
+import logging
+import os
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """Records the progress of an ingestion run after every batch.
+
+    The checkpoint carries a fingerprint of the run's inputs, and is only
+    resumed from by a run with the same fingerprint.
+    """
+
+    def __init__(self, path: str, fingerprint: Dict[str, Any]):
+        """Initialize the checkpoint.
+
+        Args:
+            path: Location of the checkpoint file
+            fingerprint: Inputs the recorded progress is only valid for
+        """
+        self.path = path
+        self.fingerprint = fingerprint
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """Return the progress of an interrupted run with the same inputs."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return None
+        except ValueError as error:
+            logger.warning(f"Ignoring unreadable checkpoint: {error}")
+            return None
+        if data.get("fingerprint") != self.fingerprint:
+            logger.info("Inputs changed since the checkpoint, starting over")
+            return None
+        return data["progress"]
+
+    def save(self, progress: Dict[str, Any]) -> None:
+        """Record the progress of the run atomically."""
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(
+                {"fingerprint": self.fingerprint, "progress": progress}, file
+            )
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def clear(self) -> None:
+        """Remove the checkpoint once the run completed."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,177 @@
+# Created by Metrum AI for Dell
+"""Streaming reader of the HSC corpus."""
+import json
+import queue
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+from langchain_core.documents import Document
+
+T = TypeVar("T")
+
+# Characters read from the corpus file at a time.
+READ_SIZE = 1 << 20
+# Characters between the JSON values of the nested arrays.
+STRUCTURAL = frozenset(" \t\r\n[],")
+# Largest object, in characters, buffered before the file is rejected.
+MAX_OBJECT_SIZE = 64 << 20
+
+
+def _byte_length(text: str) -> int:
+    """Return the length of a text in the file's UTF-8 encoding."""
+    return len(text.encode("utf-8"))
+
+
+def _object_end(text: str, start: int) -> Optional[int]:
+    """Return the end of the object starting at start, if text holds it.
+
+    Only braces and strings are tracked, so the object found may still be
+    malformed inside.
+    """
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return index + 1
+    return None
+
+
+def iter_json_objects(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the objects of a JSON file of arbitrarily nested arrays.
+
+    The file is read in fixed-size pieces and every object is decoded as
+    soon as it is complete, so memory does not grow with the file.
+
+    Args:
+        path: Path of the JSON file
+
+    Yields:
+        Objects in file order
+
+    Raises:
+        ValueError: If the arrays hold anything but objects, an object is
+            malformed or larger than MAX_OBJECT_SIZE, or the file ends
+            inside an object. The message gives the byte offset.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    # Bytes of the file before the buffer.
+    offset = 0
+    with open(path, "r", encoding="utf-8") as file:
+        while True:
+            while position < len(buffer) and buffer[position] in STRUCTURAL:
+                position += 1
+            if position == len(buffer):
+                offset += _byte_length(buffer)
+                buffer, position = file.read(READ_SIZE), 0
+                if not buffer:
+                    return
+                continue
+            if buffer[position] != "{":
+                raise ValueError(
+                    f"Expected an object in {path} at byte "
+                    f"{offset + _byte_length(buffer[:position])}, "
+                    f"got {buffer[position]!r}"
+                )
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as error:
+                # A complete object that fails to decode is malformed, and
+                # reading further would buffer the rest of the file.
+                if _object_end(buffer, position) is not None:
+                    raise ValueError(
+                        f"Malformed object in {path} at byte "
+                        f"{offset + _byte_length(buffer[:error.pos])}: "
+                        f"{error.msg}"
+                    ) from error
+                start = offset + _byte_length(buffer[:position])
+                if len(buffer) - position > MAX_OBJECT_SIZE:
+                    raise ValueError(
+                        f"Object in {path} at byte {start} is larger than "
+                        f"{MAX_OBJECT_SIZE} characters"
+                    ) from error
+                more = file.read(READ_SIZE)
+                if not more:
+                    raise ValueError(
+                        f"{path} ends inside the object at byte {start}"
+                    ) from error
+                offset = start
+                buffer, position = buffer[position:] + more, 0
+                continue
+            yield item
+
+
+def to_document(item: Dict[str, Any]) -> Document:
+    """Normalize a corpus entry into a document keyed by its section ID."""
+    doc_id = item["content"].split()[0].strip()[:-1]
+    val = (
+        item["content"]
+        .replace("\\u00a0", " ")
+        .replace("\\n", " ")
+        .replace("\\u201d", " ")
+    )
+    return Document(
+        page_content=f"{val}",
+        metadata={"id": doc_id, "metadata": item["metadata"]},
+    )
+
+
+def iter_documents(path: str) -> Iterator[Document]:
+    """Yield the normalized documents of the corpus in file order."""
+    return map(to_document, iter_json_objects(path))
+
+
+def iter_batches(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Group items into lists of at most size items."""
+    batch: List[T] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prefetch(items: Iterable[T], depth: int = 2) -> Iterator[T]:
+    """Produce items on a background thread, at most depth ahead.
+
+    Lets parsing the corpus overlap with embedding the previous batch,
+    while bounding how many batches are held in memory.
+    """
+    done = object()
+    pending: "queue.Queue[Any]" = queue.Queue(maxsize=depth)
+
+    def produce():
+        try:
+            for item in items:
+                pending.put(item)
+        except Exception as error:  # pylint: disable=broad-except
+            pending.put(error)
+            return
+        pending.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = pending.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
@@ -0,0 +1,94 @@
+# Created by Metrum AI for Dell
+"""Embedding of document batches across a pool of worker processes."""
+import logging
+import multiprocessing
+import os
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import torch
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+
+logger = logging.getLogger(__name__)
+
+Vector = List[float]
+
+# Embedding model of the worker process, loaded by _start_worker.
+_MODEL: Optional[Embeddings] = None
+
+
+def peak_rss_mb() -> float:
+    """Return the peak resident set size of this process in MiB."""
+    # ru_maxrss is reported in KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _start_worker(model_name: str, threads: int) -> None:
+    """Load the embedding model of a worker process."""
+    global _MODEL  # pylint: disable=global-statement
+    # Split the cores between the workers instead of oversubscribing them.
+    torch.set_num_threads(threads)
+    _MODEL = HuggingFaceEmbeddings(model_name=model_name)
+
+
+def _embed_shard(texts: List[str]) -> Tuple[List[Vector], float]:
+    """Embed a shard of a batch in a worker process.
+
+    Returns:
+        Vectors of the texts, and the peak RSS of the worker in MiB
+    """
+    return _MODEL.embed_documents(texts), peak_rss_mb()
+
+
+class PoolEmbeddings(Embeddings):
+    """Embeddings computed by a pool of processes, each with its own model.
+
+    Every batch is split into one shard per worker, and the vectors are
+    returned in the order of the texts.
+    """
+
+    def __init__(self, model_name: str, workers: int):
+        """Start the worker processes.
+
+        Args:
+            model_name: Name of the HuggingFace embedding model
+            workers: Number of worker processes
+        """
+        self.workers = workers
+        self.worker_peak_rss = 0.0
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        # Spawned workers do not inherit the OpenMP state of this process.
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_start_worker,
+            initargs=(model_name, threads),
+        )
+        logger.info(
+            f"Started {workers} embedding workers with {threads} threads each"
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[Vector]:
+        """Embed texts across the worker processes."""
+        if not texts:
+            return []
+        size = -(-len(texts) // self.workers)
+        shards = [
+            texts[offset : offset + size]
+            for offset in range(0, len(texts), size)
+        ]
+        vectors: List[Vector] = []
+        for shard_vectors, rss in self._pool.map(_embed_shard, shards):
+            vectors.extend(shard_vectors)
+            self.worker_peak_rss = max(self.worker_peak_rss, rss)
+        return vectors
+
+    def embed_query(self, text: str) -> Vector:
+        """Embed a query text."""
+        return self.embed_documents([text])[0]
+
+    def close(self) -> None:
+        """Stop the worker processes."""
+        self._pool.shutdown()
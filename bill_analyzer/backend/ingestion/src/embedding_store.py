@@ -0,0 +1,145 @@
+# Created by Metrum AI for Dell
+"""Memory-mapped store of the embeddings computed by ingestion."""
+import fcntl
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+Vector = List[float]
+
+
+class MmapEmbeddingStore:
+    """Append-only embedding matrix with an index of its rows by key.
+
+    Vectors are appended as float32 rows to one file, memory-mapped for
+    reads, and a log maps every key to its row. Keys are hashes of the
+    model name and text, so the store survives changes of the collection
+    or its index settings. Each model gets its own directory, as models
+    differ in dimension. A row is only logged once it is written, so an
+    interrupted run never leaves a key pointing at a partial vector.
+
+    Rows are never removed or compacted: the store grows with every
+    distinct text embedded, including the texts of earlier corpus
+    revisions. Delete the model's directory to reclaim the space.
+    """
+
+    def __init__(self, directory: str, model_name: str):
+        """Open or create the store of a model.
+
+        Args:
+            directory: Root directory of the stores
+            model_name: Name of the embedding model
+
+        Raises:
+            RuntimeError: If another ingestion run holds the store
+        """
+        self.directory = os.path.join(directory, model_name.replace("/", "--"))
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._vectors_path = os.path.join(self.directory, "vectors.f32")
+        self._keys = open(
+            os.path.join(self.directory, "keys.log"), "a+", encoding="utf-8"
+        )
+        try:
+            fcntl.flock(self._keys, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError as error:
+            raise RuntimeError(
+                f"Embedding store {self.directory} is in use"
+            ) from error
+        self._dimension = 0
+        self._rows: Dict[str, int] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._load()
+
+    def _load(self) -> None:
+        """Read the key log and memory-map the matrix."""
+        dimension_path = os.path.join(self.directory, "dimension")
+        if os.path.exists(dimension_path):
+            with open(dimension_path, "r", encoding="utf-8") as file:
+                self._dimension = int(file.read())
+        self._keys.seek(0)
+        log = self._keys.read()
+        complete = log.rfind("\n") + 1
+        if complete < len(log):
+            # Drop the line an interrupted run left half written.
+            self._keys.truncate(len(log[:complete].encode("utf-8")))
+        for line in log[:complete].splitlines():
+            key, _, row = line.partition("\t")
+            self._rows[key] = int(row)
+        self._map()
+        logger.info(
+            f"Opened embedding store of {len(self._rows)} vectors "
+            f"in {self.directory}"
+        )
+
+    def _map(self) -> None:
+        """Memory-map every complete row of the matrix."""
+        if not self._dimension or not os.path.exists(self._vectors_path):
+            self._matrix = None
+            return
+        rows = os.path.getsize(self._vectors_path) // (4 * self._dimension)
+        self._matrix = (
+            np.memmap(
+                self._vectors_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(rows, self._dimension),
+            )
+            if rows
+            else None
+        )
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Return the stored vectors of the keys that are present.
+
+        Vectors are read-only views of the memory-mapped matrix, so
+        reading them copies nothing.
+        """
+        with self._lock:
+            matrix = self._matrix
+            if matrix is None:
+                return {}
+            rows = {key: self._rows[key] for key in keys if key in self._rows}
+            return {
+                key: matrix[row]
+                for key, row in rows.items()
+                if row < len(matrix)
+            }
+
+    def put_many(self, items: Iterable[Tuple[str, Vector]]) -> None:
+        """Append vectors and log the rows of their keys."""
+        items = list(items)
+        if not items:
+            return
+        matrix = np.asarray([vector for _, vector in items], dtype=np.float32)
+        with self._lock:
+            if not self._dimension:
+                self._dimension = matrix.shape[1]
+                with open(
+                    os.path.join(self.directory, "dimension"),
+                    "w",
+                    encoding="utf-8",
+                ) as file:
+                    file.write(str(self._dimension))
+            with open(self._vectors_path, "ab") as file:
+                # Drop the partial row an interrupted write may have left.
+                first = file.tell() // (4 * self._dimension)
+                file.truncate(first * 4 * self._dimension)
+                file.write(matrix.tobytes())
+            self._keys.writelines(
+                f"{key}\t{first + offset}\n"
+                for offset, (key, _) in enumerate(items)
+            )
+            self._keys.flush()
+            for offset, (key, _) in enumerate(items):
+                self._rows[key] = first + offset
+            self._map()
+
+    def close(self) -> None:
+        """Release the store."""
+        self._keys.close()
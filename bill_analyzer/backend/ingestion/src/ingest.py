@@ -1,13 +1,27 @@
 # Created by Metrum AI for Dell
 """Module for ingesting documents into Milvus vector store."""
+import argparse
+import hashlib
+import itertools
 import json
 import logging
+import os
 import time
-from typing import Optional
+import uuid
+from typing import Any, Dict, List, Optional
 
+import numpy as np
+from checkpoint import Checkpoint
+from corpus import iter_batches, iter_documents, prefetch
+from embedding_cache import CachedEmbeddings
+from embedding_pool import PoolEmbeddings, peak_rss_mb
+from embedding_store import MmapEmbeddingStore
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_milvus import Milvus
+from local_index import LocalIndexWriter
+from pymilvus import MilvusClient
 from utils import read_config_vars
 
 logging.basicConfig(level=logging.INFO)
@@ -17,19 +31,108 @@ CONFIG = read_config_vars(
     {
         "MILVUS_URI": "http://milvus:19530",
         "EMBEDDING_MODEL": "BAAI/bge-small-en-v1.5",
+        "INDEX_DIR": "/index",
+        "CORPUS_PATH": "./data/HSC.json",
+        "INGEST_BATCH_SIZE": "256",
+        "VECTOR_BACKEND": "milvus",
+        "EMBEDDING_CACHE_SIZE": "10000",
+        "EMBEDDING_STORE_DIR": "/index/embeddings",
+        "EMBED_WORKERS": "1",
     }
 )
 
+COLLECTION_NAME = "HSC"
+# Primary keys per Milvus delete, keeping filter expressions short.
+DELETE_BATCH_SIZE = 1000
 
-try:
-    EMBEDDINGS = HuggingFaceEmbeddings(model_name=CONFIG["EMBEDDING_MODEL"])
-    MILVUS_URI = CONFIG["MILVUS_URI"]
-except KeyError as error:
-    logger.error(f"Missing required configuration: {str(error)}")
-    raise
-except Exception as error:
-    logger.error(f"Error initializing embeddings: {str(error)}")
-    raise
+
+MILVUS_URI = CONFIG["MILVUS_URI"]
+
+_EMBEDDINGS: Optional[CachedEmbeddings] = None
+
+
+def create_embeddings() -> CachedEmbeddings:
+    """Create the cached embedding model used for ingestion.
+
+    Vectors are kept in the memory-mapped store under
+    EMBEDDING_STORE_DIR, so later runs, including rebuilds into another
+    collection or index configuration, only embed new texts. With
+    EMBED_WORKERS above one, those are embedded by a pool of processes,
+    each holding its own model.
+    """
+    try:
+        workers = int(CONFIG["EMBED_WORKERS"])
+        model = (
+            PoolEmbeddings(CONFIG["EMBEDDING_MODEL"], workers)
+            if workers > 1
+            else HuggingFaceEmbeddings(model_name=CONFIG["EMBEDDING_MODEL"])
+        )
+        return CachedEmbeddings(
+            model,
+            model_name=CONFIG["EMBEDDING_MODEL"],
+            max_size=int(CONFIG["EMBEDDING_CACHE_SIZE"]),
+            store=(
+                MmapEmbeddingStore(
+                    CONFIG["EMBEDDING_STORE_DIR"], CONFIG["EMBEDDING_MODEL"]
+                )
+                if CONFIG["EMBEDDING_STORE_DIR"]
+                else None
+            ),
+        )
+    except KeyError as error:
+        logger.error(f"Missing required configuration: {str(error)}")
+        raise
+    except Exception as error:
+        logger.error(f"Error initializing embeddings: {str(error)}")
+        raise
+
+
+def get_embeddings() -> CachedEmbeddings:
+    """Return the embedding model, created on first use.
+
+    The model is not created at import, as the embedding worker
+    processes import this module again.
+    """
+    global _EMBEDDINGS  # pylint: disable=global-statement
+    if _EMBEDDINGS is None:
+        _EMBEDDINGS = create_embeddings()
+    return _EMBEDDINGS
+
+
+class ListEmbeddings(Embeddings):
+    """Embeddings returned as lists of floats, as pymilvus inserts them.
+
+    The cached embeddings return vectors read from the embedding store as
+    array views, which only the local index writer takes as they are.
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        """Wrap an embedding model."""
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts."""
+        vectors = self.embeddings.embed_documents(texts)
+        return np.asarray(vectors, dtype=np.float32).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query text."""
+        return self.embed_documents([text])[0]
+
+
+def close_embeddings() -> None:
+    """Stop the embedding worker processes and release the vector store.
+
+    The next get_embeddings call creates the model again.
+    """
+    global _EMBEDDINGS  # pylint: disable=global-statement
+    if _EMBEDDINGS is None:
+        return
+    if isinstance(_EMBEDDINGS.embeddings, PoolEmbeddings):
+        _EMBEDDINGS.embeddings.close()
+    if isinstance(_EMBEDDINGS.store, MmapEmbeddingStore):
+        _EMBEDDINGS.store.close()
+    _EMBEDDINGS = None
 
 
 def create_milvus_connection(
@@ -39,8 +142,9 @@ def create_milvus_connection(
     for attempt in range(max_retries):
         try:
             vector_store = Milvus(
-                embedding_function=EMBEDDINGS,
+                embedding_function=ListEmbeddings(get_embeddings()),
                 connection_args={"uri": MILVUS_URI},
+                collection_name=COLLECTION_NAME,
             )
             return vector_store
         except Exception as error:
@@ -56,78 +160,416 @@ def create_milvus_connection(
                 )
 
 
-vector_store = create_milvus_connection()
+def collection_exists() -> bool:
+    """Return whether the Milvus collection exists."""
+    client = MilvusClient(uri=MILVUS_URI)
+    try:
+        return client.has_collection(COLLECTION_NAME)
+    finally:
+        client.close()
 
 
-def flatten_list(nested_list):
-    """Recursively flattens a nested list into a single list."""
-    flattened = []
-    for item in nested_list:
-        if isinstance(item, list):
-            flattened.extend(flatten_list(item))
-        else:
-            flattened.append(item)
-    return flattened
+def write_collection_version() -> str:
+    """Publish a new version stamp for the collection.
+
+    The bill service keys its retrieval cache on this stamp, so writing it
+    invalidates every cached retrieval of the previous collection.
+    """
+    version = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(CONFIG["INDEX_DIR"], exist_ok=True)
+    path = os.path.join(CONFIG["INDEX_DIR"], f"{COLLECTION_NAME}.version")
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        file.write(version)
+    os.replace(f"{path}.tmp", path)
+    logger.info(f"Published collection version {version}")
+    return version
+
+
+def document_keys(
+    texts: List[Document], occurrences: Dict[str, int]
+) -> List[str]:
+    """Return the primary key of every document.
+
+    Keys combine the section ID with the occurrence of the ID in the
+    corpus, e.g. "43013#0", so they are stable across runs.
 
+    Args:
+        texts: Documents in corpus order
+        occurrences: Occurrences of each section ID so far, updated
+    """
+    keys = []
+    for text in texts:
+        section_id = text.metadata["id"]
+        keys.append(f"{section_id}#{occurrences.get(section_id, 0)}")
+        occurrences[section_id] = occurrences.get(section_id, 0) + 1
+    return keys
+
+
+def content_digest(text: Document) -> str:
+    """Return the hash of a document's section ID and normalized content."""
+    content = " ".join(text.page_content.split())
+    return hashlib.sha256(
+        f"{text.metadata['id']}\0{content}".encode("utf-8")
+    ).hexdigest()
+
+
+def manifest_path() -> str:
+    """Return the path of the manifest of the last ingestion run."""
+    return os.path.join(
+        CONFIG["INDEX_DIR"], f"{COLLECTION_NAME}.manifest.json"
+    )
 
-def load_and_process_documents():
-    """Load documents and split into texts with metadata."""
 
-    with open("./data/HSC.json", "r", encoding="utf-8") as file:
-        data = json.load(file)
-        data = flatten_list(data)
+def read_manifest() -> Optional[Dict[str, str]]:
+    """Return the document digests of the last ingestion run.
 
-    texts = []
-    for i in data:
-        doc_id = i["content"].split()[0].strip()[:-1]
-        val = (
-            i["content"]
-            .replace("\\u00a0", " ")
-            .replace("\\n", " ")
-            .replace("\\u201d", " ")
+    Returns:
+        Digest of every document keyed by primary key, or None if there
+        is no manifest or it was written for another embedding model
+    """
+    try:
+        with open(manifest_path(), "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return None
+    if manifest.get("model") != CONFIG["EMBEDDING_MODEL"]:
+        logger.info("Embedding model changed, rebuilding the collection")
+        return None
+    return manifest["documents"]
+
+
+def write_manifest(digests: Dict[str, str]) -> None:
+    """Record the document digests of this ingestion run."""
+    os.makedirs(CONFIG["INDEX_DIR"], exist_ok=True)
+    path = manifest_path()
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(
+            {"model": CONFIG["EMBEDDING_MODEL"], "documents": digests}, file
         )
-        texts.append(
-            Document(
-                page_content=f"{val}",
-                metadata={"id": doc_id, "metadata": i["metadata"]},
+    os.replace(f"{path}.tmp", path)
+
+
+class MilvusSync:
+    """Brings the Milvus collection in line with the corpus, batch by batch.
+
+    Only new and changed documents are inserted, and removed ones are
+    deleted at the end, so the collection stays searchable throughout.
+    The collection is rebuilt when there is no usable manifest.
+    """
+
+    def __init__(self, state: Optional[Dict[str, Any]] = None):
+        """Connect to Milvus and read the manifest of the last run.
+
+        Args:
+            state: State of an interrupted run to resume, from state()
+        """
+        self.vector_store = create_milvus_connection()
+        self.previous = read_manifest()
+        if self.previous is not None and not collection_exists():
+            # The manifest describes a collection that no longer exists,
+            # so none of its documents may be skipped as unchanged.
+            logger.warning("Collection is missing, ignoring the manifest")
+            self.previous = None
+        self.resumed = state is not None
+        if state is None:
+            self.rebuild = self.previous is None
+            self.created = False
+            self.changed = 0
+        else:
+            self.rebuild = state["rebuild"]
+            self.created = state["created"]
+            self.changed = state["changed"]
+        if self.rebuild:
+            # Every document is inserted and nothing is left to remove.
+            self.previous = None
+            logger.info("Rebuilding the collection")
+
+    def state(self) -> Dict[str, Any]:
+        """Return the state of the run, to resume it later."""
+        return {
+            "rebuild": self.rebuild,
+            "created": self.created,
+            "changed": self.changed,
+        }
+
+    def _delete(self, keys: List[str]) -> None:
+        """Delete documents by primary key."""
+        for start in range(0, len(keys), DELETE_BATCH_SIZE):
+            self.vector_store.delete(
+                ids=keys[start : start + DELETE_BATCH_SIZE]
+            )
+
+    def add_batch(
+        self, texts: List[Document], digests: Dict[str, str]
+    ) -> None:
+        """Apply a batch of documents.
+
+        Args:
+            texts: Documents of the batch
+            digests: Digest of every document keyed by primary key
+        """
+        keys = list(digests)
+        if self.rebuild and not self.created:
+            self.vector_store = Milvus.from_documents(
+                texts,
+                ListEmbeddings(get_embeddings()),
+                ids=keys,
+                collection_name=COLLECTION_NAME,
+                drop_old=True,
+                connection_args={"uri": MILVUS_URI},
             )
+            self.created = True
+            self.changed += len(keys)
+            return
+        previous = self.previous or {}
+        changed = [
+            index
+            for index, key in enumerate(keys)
+            if previous.get(key) != digests[key]
+        ]
+        if not changed:
+            return
+        changed_keys = [keys[index] for index in changed]
+        # Keys are deleted before they are inserted, so applying a batch
+        # again after an interrupted run never duplicates a document.
+        if not self.rebuild or self.resumed:
+            self._delete(changed_keys)
+        self.vector_store.add_documents(
+            [texts[index] for index in changed], ids=changed_keys
         )
-    return texts
+        self.changed += len(changed)
 
+    def finish(self, digests: Dict[str, str]) -> Milvus:
+        """Delete the documents no longer in the corpus.
 
-def ingest_documents():
-    """Ingest documents into Milvus vector store."""
-    texts = load_and_process_documents()
-    logger.info("Starting document ingestion...")
-    vector_store_saved = Milvus.from_documents(
-        texts,
-        EMBEDDINGS,
-        collection_name="HSC",
-        drop_old=True,
-        connection_args={"uri": MILVUS_URI},
+        Args:
+            digests: Digest of every document of the corpus
+
+        Returns:
+            Milvus vector store
+        """
+        removed = [key for key in self.previous or {} if key not in digests]
+        self._delete(removed)
+        logger.info(
+            f"{self.changed} new or changed and {len(removed)} removed "
+            f"of {len(digests)} documents"
+        )
+        return self.vector_store
+
+
+def create_checkpoint() -> Checkpoint:
+    """Create the checkpoint of an ingestion run with the current inputs."""
+    corpus = os.path.abspath(CONFIG["CORPUS_PATH"])
+    stat = os.stat(corpus)
+    path = os.path.join(
+        CONFIG["INDEX_DIR"], f"{COLLECTION_NAME}.checkpoint.json"
     )
+    return Checkpoint(
+        path,
+        {
+            "corpus": corpus,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "batch_size": int(CONFIG["INGEST_BATCH_SIZE"]),
+            "backend": CONFIG["VECTOR_BACKEND"],
+            "model": CONFIG["EMBEDDING_MODEL"],
+        },
+    )
+
+
+def ingest_documents(restart: bool = False) -> Optional[Milvus]:
+    """Ingest documents into the vector store of the configured backend.
+
+    The corpus is parsed as a stream on a background thread and processed
+    in fixed-size batches: every batch is embedded, applied to Milvus
+    against the manifest of the last run, and spilled to the local index
+    writer, so memory stays flat whatever the corpus size. The local
+    indexes are always written, so the bill service can switch backends
+    without another ingestion. Milvus is skipped when the embedded
+    backend is selected.
+
+    A checkpoint is recorded after every batch. A run interrupted with
+    the same inputs resumes after its last committed batch, and the
+    batches it committed are neither embedded nor written again.
+
+    Args:
+        restart: Ignore the checkpoint of an interrupted run
+
+    Returns:
+        Milvus vector store, or None with the embedded backend
+    """
+    try:
+        return _ingest(restart)
+    finally:
+        # Worker processes would outlive a failed run otherwise.
+        close_embeddings()
+
+
+def _ingest(restart: bool) -> Optional[Milvus]:
+    """Run the ingestion described in ingest_documents."""
+    logger.info("Starting document ingestion...")
+    start = time.perf_counter()
+    batch_size = int(CONFIG["INGEST_BATCH_SIZE"])
+    embeddings = get_embeddings()
+    writer = LocalIndexWriter(CONFIG["INDEX_DIR"], COLLECTION_NAME)
+    checkpoint = create_checkpoint()
+    progress = None if restart else checkpoint.load()
+    if progress is not None and not writer.can_resume(progress["writer"]):
+        logger.warning("Spill of the checkpoint is missing, starting over")
+        progress = None
+
+    digests: Dict[str, str] = {}
+    occurrences: Dict[str, int] = {}
+    batch = 0
+    if progress is None:
+        writer.start()
+    else:
+        # Restore the keys and digests of the committed documents.
+        committed = writer.resume(progress["writer"])
+        for texts in iter_batches(committed, batch_size):
+            keys = document_keys(texts, occurrences)
+            digests.update(zip(keys, map(content_digest, texts)))
+        batch = progress["batches"]
+        logger.info(f"Resuming after batch {batch}, {writer.count} documents")
+    sync = None
+    if CONFIG["VECTOR_BACKEND"] == "milvus":
+        sync = MilvusSync(progress["milvus"] if progress else None)
+
+    embed_seconds: List[float] = []
+    # Documents of this run, leaving out those committed before a resume.
+    processed = 0
+    try:
+        batches = iter_batches(
+            itertools.islice(
+                iter_documents(CONFIG["CORPUS_PATH"]), writer.count, None
+            ),
+            batch_size,
+        )
+        for texts in prefetch(batches):
+            batch_start = time.perf_counter()
+            keys = document_keys(texts, occurrences)
+            batch_digests = dict(zip(keys, map(content_digest, texts)))
+            # Milvus embeds the batch again, from the embedding cache.
+            vectors = embeddings.embed_documents(
+                [text.page_content for text in texts]
+            )
+            embed_seconds.append(time.perf_counter() - batch_start)
+            if sync is not None:
+                sync.add_batch(texts, batch_digests)
+            writer.add(texts, vectors)
+            digests.update(batch_digests)
+            processed += len(texts)
+            batch += 1
+            checkpoint.save(
+                {
+                    "batches": batch,
+                    "writer": writer.state(),
+                    "milvus": sync.state() if sync is not None else None,
+                }
+            )
+            seconds = time.perf_counter() - batch_start
+            logger.info(
+                f"Batch {batch}: {len(texts)} documents in {seconds:.2f}s, "
+                f"{len(texts) / seconds:.1f} docs/s"
+            )
+    except BaseException:
+        # The spill is kept for the next run to resume from.
+        writer.close()
+        raise
+
+    vector_store_saved = None
+    if sync is not None:
+        vector_store_saved = sync.finish(digests)
+        # The manifest describes the collection, so it is only updated
+        # once Milvus holds the documents.
+        write_manifest(digests)
+    writer.publish()
+    write_collection_version()
+    checkpoint.clear()
+    log_throughput(processed, time.perf_counter() - start, embed_seconds)
+    logger.info(f"Embedding cache: {embeddings.stats()}")
     logger.info("Document ingestion completed successfully")
     return vector_store_saved
 
 
-def search_documents(vector_store_saved, query_id):
-    """Search for documents using similarity search."""
-    retriever = vector_store_saved.as_retriever(
-        search_type="similarity", search_kwargs={"k": 1}
+def log_throughput(
+    count: int, seconds: float, embed_seconds: List[float]
+) -> None:
+    """Log the throughput, batch embedding latency and peak memory.
+
+    Args:
+        count: Number of documents ingested by this run
+        seconds: Duration of the ingestion
+        embed_seconds: Embedding latency of every batch
+    """
+    latencies = sorted(embed_seconds) or [0.0]
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    logger.info(
+        f"Ingested {count} documents in {seconds:.1f}s, "
+        f"{count / (seconds or 1.0):.1f} docs/s"
+    )
+    logger.info(
+        f"Batch embedding latency: p50 {p50:.2f}s, p95 {p95:.2f}s, "
+        f"max {latencies[-1]:.2f}s"
     )
-    filter_expr = f'id like "{query_id}%"'
-    results = retriever.invoke(input=query_id, expr=filter_expr)
-    return results
+    model = get_embeddings().embeddings
+    workers = (
+        f", embedding workers {model.worker_peak_rss:.0f} MiB"
+        if isinstance(model, PoolEmbeddings)
+        else ""
+    )
+    logger.info(f"Peak RSS: main {peak_rss_mb():.0f} MiB{workers}")
 
 
-def main():
-    """Main function to demonstrate document ingestion and search."""
-    vector_store_saved = ingest_documents()
-    query_id = "43013"
-    results = search_documents(vector_store_saved, query_id)
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse the command line, defaulting to the configuration."""
+    parser = argparse.ArgumentParser(
+        description="Ingest the Health and Safety Code corpus."
+    )
+    parser.add_argument(
+        "--corpus",
+        default=CONFIG["CORPUS_PATH"],
+        help="Path of the HSC.json corpus",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=int(CONFIG["INGEST_BATCH_SIZE"]),
+        help="Documents per batch",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(CONFIG["EMBED_WORKERS"]),
+        help="Embedding worker processes",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("milvus", "embedded"),
+        default=CONFIG["VECTOR_BACKEND"],
+        help="Vector store to ingest into besides the local indexes",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Ignore the checkpoint of an interrupted run and start over",
+    )
+    return parser.parse_args(argv)
 
-    for result in results:
-        logger.info(f"* {result.page_content} [{result.metadata}]")
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run an ingestion, resuming an interrupted one by default."""
+    args = parse_args(argv)
+    CONFIG.update(
+        {
+            "CORPUS_PATH": args.corpus,
+            "INGEST_BATCH_SIZE": str(args.batch_size),
+            "EMBED_WORKERS": str(args.workers),
+            "VECTOR_BACKEND": args.backend,
+        }
+    )
+    ingest_documents(restart=args.restart)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,210 @@
+# Created by Metrum AI for Dell
+"""Streaming writer of the local index files read by the bill service."""
+import json
+import logging
+import os
+import shutil
+from typing import Dict, Iterator, List, Sequence, Union
+
+import numpy as np
+from bm25 import BM25Builder
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# Rows copied at a time when sorting the vector matrix.
+COPY_ROWS = 4096
+
+
+class LocalIndexWriter:
+    """Writes the section, vector and BM25 indexes of a collection.
+
+    Documents arrive in batches in corpus order and are spilled to
+    files, so memory only holds their section IDs and BM25 postings.
+    Publishing sorts the rows by section ID, the order the bill service
+    expects, and moves every file into place atomically. A run is begun
+    with start, or with resume from the position of an interrupted one.
+    """
+
+    def __init__(self, directory: str, name: str):
+        """Initialize the writer.
+
+        Args:
+            directory: Directory the index files are published to
+            name: Collection name prefixing the index files
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = name
+        # Spill files live next to the published ones, so moving them
+        # into place never crosses file systems, and outlive a failed
+        # run so that it can be resumed.
+        self._spill = os.path.join(directory, f".{name}.spill")
+        self._vectors_path = os.path.join(self._spill, "vectors.f32")
+        self._entries_path = os.path.join(self._spill, "entries.jsonl")
+        self._vectors = None
+        self._entries = None
+        self._offsets: List[int] = []
+        self._ids: List[str] = []
+        self._dimension = 0
+        self._bm25 = BM25Builder()
+
+    @property
+    def count(self) -> int:
+        """Return the number of documents written so far."""
+        return len(self._ids)
+
+    def start(self) -> None:
+        """Start a new run, discarding the spill of any earlier one."""
+        shutil.rmtree(self._spill, ignore_errors=True)
+        os.makedirs(self._spill)
+        self._vectors = open(self._vectors_path, "wb")
+        self._entries = open(self._entries_path, "w+", encoding="utf-8")
+
+    def state(self) -> Dict[str, int]:
+        """Return the position of the spill, to resume from it later."""
+        return {
+            "documents": self.count,
+            "entries_bytes": self._entries.tell(),
+            "dimension": self._dimension,
+        }
+
+    def can_resume(self, state: Dict[str, int]) -> bool:
+        """Return whether the spill still holds a recorded position."""
+        try:
+            vectors = os.path.getsize(self._vectors_path)
+            entries = os.path.getsize(self._entries_path)
+        except FileNotFoundError:
+            return False
+        return (
+            vectors >= state["documents"] * state["dimension"] * 4
+            and entries >= state["entries_bytes"]
+        )
+
+    def resume(self, state: Dict[str, int]) -> Iterator[Document]:
+        """Reopen the spill at a recorded position.
+
+        Anything written after the position is discarded, and the
+        documents before it are read back to restore the writer.
+
+        Args:
+            state: Position returned by state
+
+        Yields:
+            Documents already written, in corpus order
+        """
+        self._dimension = state["dimension"]
+        self._vectors = open(self._vectors_path, "r+b")
+        self._vectors.truncate(state["documents"] * self._dimension * 4)
+        self._vectors.seek(0, os.SEEK_END)
+        self._entries = open(self._entries_path, "r+", encoding="utf-8")
+        self._entries.truncate(state["entries_bytes"])
+        self._entries.seek(0)
+        while True:
+            offset = self._entries.tell()
+            line = self._entries.readline()
+            if not line:
+                break
+            section_id, text, metadata = json.loads(line)
+            self._offsets.append(offset)
+            self._ids.append(section_id)
+            self._bm25.add(text)
+            yield Document(page_content=text, metadata=metadata)
+
+    def _path(self, suffix: str) -> str:
+        """Return the published path of an index file."""
+        return os.path.join(self.directory, f"{self.name}.{suffix}")
+
+    def add(
+        self,
+        documents: List[Document],
+        vectors: Sequence[Union[Sequence[float], np.ndarray]],
+    ) -> None:
+        """Append a batch of documents and their embeddings.
+
+        Args:
+            documents: Documents of the batch
+            vectors: Embedding of every document, as lists or arrays
+        """
+        # Copied, as the rows are normalized in place and may be views
+        # of the read-only embedding store.
+        matrix = np.array(vectors, dtype=np.float32).reshape(
+            len(documents), -1
+        )
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1.0, norms)
+        self._dimension = matrix.shape[1]
+        self._vectors.write(matrix.tobytes())
+        for document in documents:
+            self._offsets.append(self._entries.tell())
+            entry = [
+                document.metadata["id"],
+                document.page_content,
+                document.metadata,
+            ]
+            self._entries.write(json.dumps(entry) + "\n")
+            self._ids.append(document.metadata["id"])
+            self._bm25.add(document.page_content)
+        # Spilled rows must be on disk before a checkpoint records them.
+        self._vectors.flush()
+        self._entries.flush()
+
+    def _publish_vectors(self, order: List[int]) -> None:
+        """Write the normalized embeddings, rows sorted by section ID."""
+        self._vectors.close()
+        shape = (len(order), self._dimension)
+        path = self._path("vectors.npy")
+        output = np.lib.format.open_memmap(
+            f"{path}.tmp", mode="w+", dtype=np.float32, shape=shape
+        )
+        if len(order):
+            spilled = np.memmap(
+                self._vectors.name, dtype=np.float32, mode="r", shape=shape
+            )
+            for start in range(0, len(order), COPY_ROWS):
+                rows = order[start : start + COPY_ROWS]
+                output[start : start + len(rows)] = spilled[rows]
+            del spilled
+        output.flush()
+        del output
+        os.replace(f"{path}.tmp", path)
+        logger.info(f"Published vector index of shape {shape}")
+
+    def _publish_bm25(self, order: List[int]) -> None:
+        """Write the BM25 index, rows sorted by section ID."""
+        index = self._bm25.build(order)
+        path = self._path("bm25.json")
+        index.save(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+        logger.info(f"Published BM25 index of {len(index.postings)} terms")
+
+    def _publish_sections(self, order: List[int]) -> None:
+        """Write the documents as a JSON array sorted by section ID."""
+        path = self._path("sections.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            file.write("[")
+            for position, row in enumerate(order):
+                self._entries.seek(self._offsets[row])
+                if position:
+                    file.write(",")
+                file.write(self._entries.readline().rstrip("\n"))
+            file.write("]")
+        os.replace(f"{path}.tmp", path)
+        logger.info(f"Published section index of {len(order)} documents")
+
+    def publish(self) -> None:
+        """Sort the rows by section ID and publish every index file."""
+        order = sorted(range(len(self._ids)), key=self._ids.__getitem__)
+        try:
+            self._publish_vectors(order)
+            self._publish_bm25(order)
+            self._publish_sections(order)
+        finally:
+            self.close()
+        shutil.rmtree(self._spill, ignore_errors=True)
+
+    def close(self) -> None:
+        """Close the spill files, keeping them for a later resume."""
+        for spill in (self._vectors, self._entries):
+            if spill is not None:
+                spill.close()
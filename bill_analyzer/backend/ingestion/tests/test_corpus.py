@@ -0,0 +1,49 @@
+# Created by Metrum AI for Dell
+"""Tests of the streaming reader of the HSC corpus."""
+import json
+
+import corpus
+import pytest
+from corpus import iter_json_objects
+
+
+def write(tmp_path, text):
+    """Write a corpus file and return its path."""
+    path = tmp_path / "HSC.json"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_objects_split_across_reads(tmp_path, monkeypatch):
+    """Objects that straddle two reads are decoded whole."""
+    monkeypatch.setattr(corpus, "READ_SIZE", 7)
+    items = [[{"content": f"{number}. é {{text}}"}] for number in range(5)]
+    path = write(tmp_path, json.dumps(items, ensure_ascii=False))
+    assert list(iter_json_objects(path)) == [item[0] for item in items]
+
+
+def test_malformed_object_names_its_byte_offset(tmp_path, monkeypatch):
+    """A malformed object fails at its offset instead of reading on."""
+    monkeypatch.setattr(corpus, "READ_SIZE", 8)
+    text = '[{"a": "é"}, {"b" 1}, ' + '{"c": 2}, ' * 1000 + "]"
+    path = write(tmp_path, text)
+    objects = iter_json_objects(path)
+    assert next(objects) == {"a": "é"}
+    with pytest.raises(ValueError, match="Malformed object .* at byte 19"):
+        next(objects)
+
+
+def test_oversized_object_is_rejected(tmp_path, monkeypatch):
+    """An object that never closes stops at the size cap."""
+    monkeypatch.setattr(corpus, "READ_SIZE", 16)
+    monkeypatch.setattr(corpus, "MAX_OBJECT_SIZE", 64)
+    path = write(tmp_path, '[{"a": [' + "1, " * 1000 + "]")
+    with pytest.raises(ValueError, match="at byte 1 is larger than 64"):
+        list(iter_json_objects(path))
+
+
+def test_truncated_file_names_the_object(tmp_path):
+    """A file that ends inside an object names where the object starts."""
+    path = write(tmp_path, '[{"a": 1}, {"b": ')
+    with pytest.raises(ValueError, match="ends inside the object at byte 11"):
+        list(iter_json_objects(path))
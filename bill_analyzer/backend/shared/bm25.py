@@ -0,0 +1,169 @@
+# Created by Metrum AI for Dell
+"""BM25 lexical index of the collection.
+
+Shared by the bill and ingestion services: ingestion builds and
+publishes the index, and the bill service searches it. Rows follow the
+section index, sorted by section ID.
+"""
+import json
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Words and statute numbers, e.g. "25249.5" stays one token.
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase index terms."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Builder:
+    """Accumulates the postings of texts added one at a time."""
+
+    def __init__(self):
+        """Initialize an empty builder."""
+        self.postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        self.lengths: List[int] = []
+
+    def add(self, text: str) -> None:
+        """Add a text as the next row."""
+        row = len(self.lengths)
+        terms = tokenize(text)
+        self.lengths.append(len(terms))
+        for term, frequency in Counter(terms).items():
+            rows, frequencies = self.postings.setdefault(term, ([], []))
+            rows.append(row)
+            frequencies.append(frequency)
+
+    def build(
+        self, order: Optional[Sequence[int]] = None, **params: float
+    ) -> "BM25Index":
+        """Build the index of the added texts.
+
+        Args:
+            order: Optional added row of every index row, to reorder rows
+            params: BM25 parameters
+
+        Returns:
+            BM25 index
+        """
+        if order is None:
+            return BM25Index(self.postings, self.lengths, **params)
+        position = np.empty(len(order), dtype=np.int64)
+        position[np.asarray(order, dtype=np.int64)] = np.arange(len(order))
+        postings = {}
+        for term, (rows, frequencies) in self.postings.items():
+            moved = position[np.asarray(rows, dtype=np.int64)]
+            sort = np.argsort(moved, kind="stable")
+            postings[term] = (
+                moved[sort].tolist(),
+                np.asarray(frequencies)[sort].tolist(),
+            )
+        lengths = np.asarray(self.lengths)[np.asarray(order, dtype=int)]
+        return BM25Index(postings, lengths.tolist(), **params)
+
+
+class BM25Index:
+    """Okapi BM25 inverted index."""
+
+    def __init__(
+        self,
+        postings: Dict[str, Tuple[List[int], List[int]]],
+        lengths: List[int],
+        k1: float = 1.5,
+        b: float = 0.75,
+    ):
+        """Initialize the index.
+
+        Args:
+            postings: Rows and term frequencies of every term
+            lengths: Number of terms of every row
+            k1: Term frequency saturation
+            b: Document length normalization
+        """
+        self.k1 = k1
+        self.b = b
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        average = float(self.lengths.mean()) if len(lengths) else 1.0
+        self._norms = k1 * (1 - b + b * self.lengths / (average or 1.0))
+        self.postings = {
+            term: (
+                np.asarray(rows, dtype=np.int64),
+                np.asarray(frequencies, dtype=np.float32),
+            )
+            for term, (rows, frequencies) in postings.items()
+        }
+
+    @classmethod
+    def build(cls, texts: Iterable[str], **params: float) -> "BM25Index":
+        """Build the index of texts, one row per text."""
+        builder = BM25Builder()
+        for text in texts:
+            builder.add(text)
+        return builder.build(**params)
+
+    def save(self, path: str) -> None:
+        """Write the index as JSON."""
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "k1": self.k1,
+                    "b": self.b,
+                    "lengths": self.lengths.astype(int).tolist(),
+                    "postings": {
+                        term: [rows.tolist(), frequencies.astype(int).tolist()]
+                        for term, (rows, frequencies) in self.postings.items()
+                    },
+                },
+                file,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Read an index written by save."""
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        return cls(
+            {term: tuple(pair) for term, pair in data["postings"].items()},
+            data["lengths"],
+            k1=data["k1"],
+            b=data["b"],
+        )
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Return the k best rows for a query.
+
+        Args:
+            query: Query text
+            k: Number of rows
+
+        Returns:
+            Rows and their BM25 score, best first. Rows sharing no term
+            with the query are left out.
+        """
+        count = len(self.lengths)
+        scores = np.zeros(count, dtype=np.float32)
+        for term, weight in Counter(tokenize(query)).items():
+            if term not in self.postings:
+                continue
+            rows, frequencies = self.postings[term]
+            idf = math.log(1 + (count - len(rows) + 0.5) / (len(rows) + 0.5))
+            scores[rows] += (
+                weight
+                * idf
+                * frequencies
+                * (self.k1 + 1)
+                / (frequencies + self._norms[rows])
+            )
+        matched = int(np.count_nonzero(scores))
+        if not matched:
+            return []
+        count = min(k, matched)
+        top = np.argpartition(-scores, count - 1)[:count]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(row), float(scores[row])) for row in top]
@@ -0,0 +1,238 @@
+# Created by Metrum AI for Dell
+"""Caching wrapper around an embedding model.
+
+Shared by the bill and ingestion services, whose images copy it next to
+their own sources.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterable, List, Optional, Protocol, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+Vector = List[float]
+
+
+class EmbeddingStore(Protocol):
+    """Persistent store of embedding vectors by cache key."""
+
+    def get_many(self, keys: List[str]) -> Dict[str, Vector]:
+        """Return the stored vectors of the keys that are present."""
+
+    def put_many(self, items: Iterable[Tuple[str, Vector]]) -> None:
+        """Store vectors by key."""
+
+
+class SQLiteEmbeddingStore:
+    """Persistent store of embedding vectors in a SQLite file."""
+
+    def __init__(self, path: str):
+        """Open or create the store.
+
+        Args:
+            path: Location of the SQLite file
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=30, check_same_thread=False
+        )
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+
+    def get_many(self, keys: List[str]) -> Dict[str, Vector]:
+        """Return the stored vectors of the keys that are present."""
+        found: Dict[str, Vector] = {}
+        # Stay below SQLite's limit on query parameters.
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT key, vector FROM embeddings "
+                    f"WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+            for key, blob in rows:
+                found[key] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, Vector]]) -> None:
+        """Store vectors, replacing any stored under the same keys."""
+        rows = [(key, array("f", vector).tobytes()) for key, vector in items]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) "
+                "VALUES (?, ?)",
+                rows,
+            )
+
+
+class _BatchCoalescer:
+    """Merges concurrent embedding requests into one model call.
+
+    The first caller waits for a short window, then embeds the texts of
+    every request that arrived meanwhile in one batch.
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[List[str]], List[Vector]],
+        window: float,
+        max_batch: int,
+    ):
+        self._embed = embed
+        self._window = window
+        self._max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[List[str], Future]] = []
+        self._leader = False
+
+    def embed(self, texts: List[str]) -> List[Vector]:
+        """Embed texts, sharing the model call with concurrent requests."""
+        if self._window <= 0 or len(texts) >= self._max_batch:
+            return self._embed(texts)
+        future: Future = Future()
+        with self._lock:
+            self._pending.append((texts, future))
+            lead = not self._leader
+            self._leader = True
+        if lead:
+            time.sleep(self._window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._leader = False
+            self._run(batch)
+        return future.result()
+
+    def _run(self, batch: List[Tuple[List[str], Future]]) -> None:
+        """Embed the distinct texts of a batch and resolve its requests."""
+        unique = list(
+            dict.fromkeys(text for texts, _ in batch for text in texts)
+        )
+        try:
+            vectors = dict(zip(unique, self._embed(unique)))
+        except Exception as error:  # pylint: disable=broad-except
+            for _, future in batch:
+                future.set_exception(error)
+            return
+        for texts, future in batch:
+            future.set_result([vectors[text] for text in texts])
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings that reuse vectors of texts embedded before.
+
+    Vectors are looked up in an in-memory LRU, then in the optional
+    persistent store, keyed by model name and text hash. The remaining
+    texts of concurrent requests are embedded together in one batch.
+    Queries are embedded like documents, which matches models without a
+    query instruction, such as the BGE models used here.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_name: str,
+        max_size: int,
+        store: Optional[EmbeddingStore] = None,
+        batch_window: float = 0.005,
+        max_batch: int = 64,
+    ):
+        """Initialize the wrapper.
+
+        Args:
+            embeddings: Embedding model to wrap
+            model_name: Name of the model, part of every cache key
+            max_size: Maximum number of vectors kept in memory
+            store: Optional persistent store
+            batch_window: Seconds a request waits for others to batch with
+            max_batch: Requests with at least this many texts skip waiting
+        """
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_size = max_size
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Vector]" = OrderedDict()
+        self._coalescer = _BatchCoalescer(
+            embeddings.embed_documents, batch_window, max_batch
+        )
+
+    def _key(self, text: str) -> str:
+        """Return the cache key of a text."""
+        return hashlib.sha256(
+            f"{self.model_name}\0{text}".encode("utf-8")
+        ).hexdigest()
+
+    def _remember(self, items: Iterable[Tuple[str, Vector]]) -> None:
+        """Insert vectors into the in-memory LRU."""
+        with self._lock:
+            for key, vector in items:
+                self._memory[key] = vector
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.max_size:
+                self._memory.popitem(last=False)
+
+    def embed_documents(self, texts: List[str]) -> List[Vector]:
+        """Embed texts, computing only the ones not cached yet."""
+        keys = [self._key(text) for text in texts]
+        found: Dict[str, Vector] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing and self.store is not None:
+            stored = self.store.get_many(missing)
+            self._remember(stored.items())
+            found.update(stored)
+            missing = [key for key in missing if key not in stored]
+
+        if missing:
+            texts_by_key = dict(zip(keys, texts))
+            vectors = self._coalescer.embed(
+                [texts_by_key[key] for key in missing]
+            )
+            computed = list(zip(missing, vectors))
+            self._remember(computed)
+            if self.store is not None:
+                self.store.put_many(computed)
+            found.update(computed)
+
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> Vector:
+        """Embed a query text."""
+        return self.embed_documents([text])[0]
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hit and miss counters."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._memory),
+            }